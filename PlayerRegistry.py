@@ -0,0 +1,57 @@
+from ReplayParser import clean_displayname
+
+class PlayerRegistry:
+    # Interns every player name into an integer id, so searches and statistics compare ints instead of strings.
+    # Names are normalized with clean_displayname once per distinct spelling: the exact string seen in a replay is
+    # looked up first, and only an unseen spelling is stripped of "/steam" and lowercased.
+    # aliases are groups of names belonging to one person (several accounts, renamed display names), every name in
+    # a group gets the same id and the first name of the group is shown for it.
+    def __init__(self, aliases=()):
+        self.__ids = {}
+        self.__normalized_ids = {}
+        # display form of every player id (without "/steam", case kept)
+        self.names = []
+        for group in aliases:
+            names = [name for name in group if name]
+            if not names:
+                continue
+            player_id = self.__add(names[0])
+            for name in names[1:]:
+                self.__normalized_ids.setdefault(clean_displayname(name), player_id)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __add(self, name):
+        normalized = clean_displayname(name)
+        player_id = self.__normalized_ids.get(normalized)
+        if player_id is None:
+            player_id = self.__normalized_ids[normalized] = len(self.names)
+            self.names.append(clean_displayname(name, lower=False))
+        return player_id
+
+    def player_id(self, name):
+        # the id of a display name from a replay, registering it if it is new
+        player_id = self.__ids.get(name)
+        if player_id is None:
+            player_id = self.__ids[name] = self.__add(name)
+        return player_id
+
+    def display_id(self, name):
+        # the id of a display name or alias, or None if neither has been seen; usernames are not looked up
+        player_id = self.__ids.get(name)
+        if player_id is None:
+            player_id = self.__normalized_ids.get(clean_displayname(name))
+        return player_id
+
+    def spellings(self, names):
+        # the normalized searched names and every alias spelling of them. A replay role matches a search when its
+        # display name or its username has one of these spellings, whichever engine runs it and whatever replays
+        # the registry has seen so far; nothing is registered
+        ids = {player_id for player_id in map(self.display_id, names) if player_id is not None}
+        spellings = {clean_displayname(name) for name in names}
+        spellings.update(normalized for normalized, player_id in self.__normalized_ids.items() if player_id in ids)
+        return spellings
+
+    def name(self, player_id):
+        return self.names[player_id]
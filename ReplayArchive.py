@@ -0,0 +1,156 @@
+import mmap
+import struct
+from base64 import urlsafe_b64encode
+from struct import Struct
+from ReplayParser import ReplayParser
+
+class ReplayArchive:
+    # One file holding the raw headers of many replays:
+    #   "RPAR", format version, record count
+    #   a table of (uuid, offset, length) records sorted by uuid bytes
+    #   the header bytes themselves, exactly as read from the .replay files
+    # The archive is opened with a single mmap, looking a replay up by uuid is a binary search over the table,
+    # a header is only decoded into a Replay when it is asked for, and search(query) skips non-matching headers
+    # before decoding them.
+    __MAGIC = b"RPAR"
+    __FORMAT_VERSION = 1
+    __PREAMBLE = Struct("<4sII")
+    __RECORD = Struct("<16sQH")
+
+    def __init__(self, archive_path, parser=None):
+        self.path = archive_path
+        self.parser = parser if parser else ReplayParser()
+        self.__file = open(archive_path, "rb")
+        try:
+            self.__data = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            self.__file.close()
+            raise ValueError(f"{archive_path} is not a version {self.__FORMAT_VERSION} replay archive") from None
+        except BaseException:
+            self.__file.close()
+            raise
+        try:
+            magic, format_version, self.__count = self.__PREAMBLE.unpack_from(self.__data)
+        except struct.error:
+            # shorter than the preamble
+            magic = format_version = None
+        if magic != self.__MAGIC or format_version != self.__FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{archive_path} is not a version {self.__FORMAT_VERSION} replay archive")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.__data.close()
+        self.__file.close()
+
+    def __len__(self):
+        return self.__count
+
+    def __record(self, index):
+        return self.__RECORD.unpack_from(self.__data, self.__PREAMBLE.size + index * self.__RECORD.size)
+
+    def __find(self, raw_uuid):
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__record(middle)[0] < raw_uuid:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.__count and self.__record(low)[0] == raw_uuid:
+            return low
+
+    def __index(self, uuid):
+        try:
+            return self.__find(ReplayParser.uuid_bytes(uuid))
+        except ValueError:
+            return None
+
+    def __contains__(self, uuid):
+        return self.__index(uuid) is not None
+
+    def uuids(self):
+        for index in range(self.__count):
+            yield urlsafe_b64encode(self.__record(index)[0]).decode().rstrip("=")
+
+    def header(self, uuid):
+        index = self.__index(uuid)
+        if index is None:
+            raise KeyError(uuid)
+        _, offset, length = self.__record(index)
+        return self.__data[offset:offset + length]
+
+    def get(self, uuid, mission_container=set):
+        try:
+            return self.parser.decode(self.header(uuid), mission_container)
+        except KeyError:
+            return None
+
+    def __iter__(self):
+        # replays in uuid order, decoded one at a time
+        return self.search()
+
+    def search(self, query=None, mission_container=set, lazy_names=False, seen=None):
+        # the replays matching a ReplayQuery, in uuid order; its fixed-field criteria are checked on the raw
+        # headers (see ReplayParser.decode), so only matching records are ever unpacked into Replays
+        view = memoryview(self.__data)
+        try:
+            for index in range(self.__count):
+                _, offset, length = self.__record(index)
+                replay = self.parser.decode(view[offset:offset + length], mission_container, lazy_names, query, seen)
+                if replay:
+                    yield replay
+        finally:
+            view.release()
+
+    @classmethod
+    def write(cls, archive_path, headers):
+        # headers is an iterable of raw header bytes, unreadable headers and repeated uuids are skipped
+        parser = ReplayParser()
+        records = {}
+        for header in headers:
+            replay = parser.decode(header)
+            if replay is None:
+                continue
+            records.setdefault(ReplayParser.uuid_bytes(replay.uuid), bytes(header))
+
+        offset = cls.__PREAMBLE.size + len(records) * cls.__RECORD.size
+        with open(archive_path, "wb") as archive:
+            archive.write(cls.__PREAMBLE.pack(cls.__MAGIC, cls.__FORMAT_VERSION, len(records)))
+            for raw_uuid in sorted(records):
+                archive.write(cls.__RECORD.pack(raw_uuid, offset, len(records[raw_uuid])))
+                offset += len(records[raw_uuid])
+            for raw_uuid in sorted(records):
+                archive.write(records[raw_uuid])
+        return len(records)
+
+    @classmethod
+    def export(cls, archive_path, file_paths, reader=None):
+        # packs the header bytes of .replay files, the same bytes ReplayParser.parse reads
+        parser = ReplayParser()
+        if reader is None:
+            headers = (parser.read_header(file_path) for file_path in file_paths)
+        else:
+            headers = reader.read(file_paths, parser.header_limit())
+        return cls.write(archive_path, headers)
+
+    @staticmethod
+    def __file_version(replay):
+        # the oldest format that still has every field the replay carries, so re-encoding does not invent values
+        if replay.guests is None and replay.clock is None:
+            return 4
+        if replay.variant is None:
+            return 5
+        return 6
+
+    @classmethod
+    def export_replays(cls, archive_path, replays):
+        # for replays that only exist as parsed records (e.g. from the ReplayCache), headers are re-encoded
+        parser = ReplayParser()
+        return cls.write(archive_path, (parser.encode(replay, cls.__file_version(replay)) for replay in replays))
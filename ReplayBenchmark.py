@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from os import path
+from ReplayCorpus import ReplayCorpus
+from ReplayIO import ReplayReader
+from ReplayParser import ReplayParser, clean_displayname
+from ReplayPipeline import ReplayPipeline
+from ReplayQuery import ReplayQuery
+from ReplayStats import ReplayStats
+from ReplayTable import ReplayTable
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:  # not available on Windows, peak RSS is reported as None there
+    getrusage = None
+
+class DictReplay:
+    # the pre-__slots__ layout of ReplayParser.Replay, kept only as a memory baseline
+    def __init__(self, replay):
+        self.uuid = replay.uuid
+        self.playid = replay.playid
+        self.date = replay.date
+        self.spy = replay.spy
+        self.spy_username = replay.spy_username
+        self.sniper = replay.sniper
+        self.sniper_username = replay.sniper_username
+        self.result = replay.result
+        self.setup = replay.setup
+        self.venue = replay.venue
+        self.variant = replay.variant
+        self.guests = replay.guests
+        self.clock = replay.clock
+        self.duration = replay.duration
+        self.selected_missions = replay.selected_missions
+        self.completed_missions = replay.completed_missions
+        self.picked_missions = replay.picked_missions
+
+def synthetic_replay(n):
+    return ReplayParser.Replay(
+        uuid=f"{n:022d}", playid=n % 65536, timestamp=1600000000 + 60 * n,
+        spy_displayname=f"Spy {n % 1000}", sniper_displayname=f"Sniper {n % 1000}",
+        spy_username=f"spy{n % 1000}/steam", sniper_username=f"sniper{n % 1000}/steam",
+        result="Missions Win", venue="Teien", variant="BooksBooksBooks", setup="a4/5",
+        guests=12, clock=210, duration=n % 400,
+        selected_missions=0b00111110, picked_missions=0, completed_missions=0b00011110
+    )
+
+def copy_replay(replay):
+    return ReplayParser.Replay(
+        uuid=replay.uuid, playid=replay.playid, timestamp=replay.timestamp,
+        spy_displayname=replay.spy, sniper_displayname=replay.sniper,
+        spy_username=replay.spy_username, sniper_username=replay.sniper_username,
+        result=replay.result, venue=replay.venue, variant=replay.variant, setup=replay.setup,
+        guests=replay.guests, clock=replay.clock, duration=replay.duration,
+        selected_missions=replay.selected_bits, picked_missions=replay.picked_bits,
+        completed_missions=replay.completed_bits
+    )
+
+def measure_bytes_per_item(build, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [build(n) for n in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(items)
+
+def benchmark_replay_memory(count=100000):
+    # both layouts share the same name strings, so the difference is the record itself
+    replays = [synthetic_replay(n) for n in range(count)]
+    slotted = measure_bytes_per_item(lambda n: copy_replay(replays[n]), count)
+    with_dict = measure_bytes_per_item(lambda n: DictReplay(replays[n]), count)
+    return {
+        "replays": count,
+        "bytes_per_replay_dict": round(with_dict, 1),
+        "bytes_per_replay_slots": round(slotted, 1),
+    }
+
+def benchmark_import_time(modules=("ReplayParser", "ReplayQuery", "ReplayCache", "cli", "client"), repeat=5):
+    # cold-start cost of each entry point in a fresh interpreter: the cumulative microseconds python -X importtime
+    # reports for the module (best of repeat) and the whole interpreter run, modules that fail to import get None
+    results = []
+    for module in modules:
+        import_times, run_times = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                capture_output=True, text=True, cwd=path.dirname(path.abspath(__file__))
+            )
+            run_times.append(time.perf_counter() - start)
+            if completed.returncode:
+                break
+            import_times.append(int(completed.stderr.strip().splitlines()[-1].split("|")[1]))
+        results.append({
+            "module": module,
+            "import_us": min(import_times) if import_times else None,
+            "interpreter_seconds": round(min(run_times), 4),
+        })
+    return results
+
+def peak_rss_kb():
+    return getrusage(RUSAGE_SELF).ru_maxrss if getrusage else None
+
+def bytes_read_so_far():
+    # rchar counts every byte this process has read through read() and friends, Linux only
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+def run_stage(stage, files, function):
+    bytes_before = bytes_read_so_far()
+    start = time.perf_counter()
+    output = function()
+    seconds = time.perf_counter() - start
+    bytes_after = bytes_read_so_far()
+    return output, {
+        "stage": stage,
+        "files": files,
+        "seconds": round(seconds, 4),
+        "files_per_second": round(files / seconds) if seconds else None,
+        "bytes_read": bytes_after - bytes_before if bytes_before is not None else None,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+def with_latency(read_header, seconds):
+    # a filesystem shim for the pipeline stages: every header read waits first, like a network mount would
+    def slow_read_header(replay_path):
+        time.sleep(seconds)
+        return read_header(replay_path)
+
+    async def async_read_header(replay_path):
+        await asyncio.sleep(seconds)
+        return read_header(replay_path)
+    return slow_read_header, async_read_header
+
+def aggregate_players(replays):
+    # the per-player win/loss counting of client.replay_analysis_window
+    snipers, spies = Counter(), Counter()
+    for replay in replays:
+        spy_win = replay.spy_win()
+        snipers[clean_displayname(replay.sniper, lower=False), not spy_win] += 1
+        spies[clean_displayname(replay.spy, lower=False), spy_win] += 1
+    return snipers, spies
+
+def benchmark_corpus(directory, count, processes=1, seed=0):
+    # the corpus is written once per size and reused by later runs, peak RSS is the process-wide peak so far
+    corpus_directory = path.join(directory, str(count))
+    parser = ReplayParser()
+    if path.isdir(corpus_directory):
+        replay_paths = parser.find_replays(corpus_directory)
+    else:
+        replay_paths = ReplayCorpus(seed=seed, parser=parser).write(corpus_directory, count)
+    files = len(replay_paths)
+
+    results = []
+    replays, result = run_stage("parse", files, lambda: list(parser.parse_replays(replay_paths, processes=processes)))
+    results.append(result)
+    _, result = run_stage("scan", files, lambda: sum(1 for _ in parser.scan_replays(corpus_directory)))
+    results.append(result)
+    for stage, reader in (("parse_threaded", ReplayReader()), ("parse_mmap", ReplayReader(use_mmap=True))):
+        _, result = run_stage(stage, files, lambda: sum(1 for _ in parser.parse_replays(replay_paths, reader=reader)))
+        results.append(result)
+    # a fixed-field scan, lazy names are only decoded for the replays that match
+    venue_query = ReplayQuery(venues=["Teien"], results=["Spy Shot"])
+    for stage, lazy_names in (("scan_filter", False), ("scan_filter_lazy_names", True)):
+        _, result = run_stage(stage, files, lambda: sum(len(replay.spy) for replay in venue_query.filter(
+            parser.scan_replays(corpus_directory, lazy_names=lazy_names)
+        )))
+        results.append(result)
+    _, result = run_stage("scan_pushdown", files, lambda: sum(
+        len(replay.spy) for replay in parser.scan_replays(corpus_directory, query=venue_query)
+    ))
+    results.append(result)
+    # the same pushdown scan with 1ms of latency per read, sequential against the asyncio pipeline; the sequential
+    # one needs a second per thousand files, so only small corpora run these
+    if files <= 10000:
+        slow_read_header, async_read_header = with_latency(parser.read_header, 0.001)
+        _, result = run_stage("scan_latency", files, lambda: sum(
+            1 for replay in map(lambda replay_path: parser.decode(slow_read_header(replay_path), query=venue_query),
+                                replay_paths) if replay
+        ))
+        results.append(result)
+        pipeline_stages = (("pipeline_latency", slow_read_header), ("pipeline_latency_async", async_read_header))
+        for stage, read_header in pipeline_stages:
+            pipeline = ReplayPipeline(parser, read_header=read_header)
+            _, result = run_stage(stage, files, lambda: len(pipeline.find_and_filter_replays(
+                corpus_directory, venue_query
+            )))
+            results.append(result)
+    replay_table, result = run_stage("table", files, lambda: ReplayTable(replays))
+    results.append(result)
+    _, result = run_stage("filter", files, lambda: replay_table.select([
+        replay_table.venue_mask(["Teien", "Aquarium", "Balcony"]),
+        replay_table.mission_mask({"Bug", "Contact"}),
+        replay_table.countdown_mask(),
+    ]))
+    results.append(result)
+    _, result = run_stage("filter_lambdas", files, lambda: ReplayParser.filter_replays(replays, [
+        lambda replay: replay.venue in {"Teien", "Aquarium", "Balcony"},
+        lambda replay: {"Bug", "Contact"} <= replay.completed_missions,
+        lambda replay: len(replay.completed_missions) >= int(replay.setup[1]),
+    ]))
+    results.append(result)
+    query = ReplayQuery(venues=["Teien", "Aquarium", "Balcony"], missions={"Bug", "Contact"}, countdown=True)
+    _, result = run_stage("filter_query", files, lambda: query.filter(replays))
+    results.append(result)
+    _, result = run_stage("aggregate", files, lambda: aggregate_players(replays))
+    results.append(result)
+    _, result = run_stage("aggregate_table", files, lambda: ReplayStats(replay_table).sorted("overall"))
+    results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description="ReParty parsing and search benchmarks")
+    argument_parser.add_argument("directory", help="where the synthetic corpora are written and reused")
+    argument_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    argument_parser.add_argument("--processes", type=int, default=1)
+    argument_parser.add_argument("--json", help="also write all results to this file")
+    arguments = argument_parser.parse_args()
+
+    all_results = {"date": str(datetime.now()), "corpora": {}}
+    for size in arguments.sizes:
+        all_results["corpora"][size] = benchmark_corpus(arguments.directory, size, processes=arguments.processes)
+        for stage_result in all_results["corpora"][size]:
+            print(stage_result)
+    all_results["imports"] = benchmark_import_time()
+    for import_result in all_results["imports"]:
+        print(import_result)
+    # last, so its 100k in-memory replays do not inflate the peak RSS of the corpus stages
+    all_results["memory"] = benchmark_replay_memory()
+    print(f"replay memory {all_results['memory']}")
+    if arguments.json:
+        with open(arguments.json, "w") as f:
+            json.dump(all_results, f, indent=4)
@@ -0,0 +1,218 @@
+import json
+import os
+from os import path
+from threading import Lock, RLock
+from PlayerRegistry import PlayerRegistry
+from ReplayParser import ReplayParser
+from ReplayTable import ReplayTable
+
+class ReplayCache:
+    # entries are keyed by file path and only re-parsed when the file's mtime or size changes;
+    # files that failed to parse are remembered as None so they are not retried every search.
+    # On disk the cache is a JSON snapshot plus a journal of the entries changed since (one JSON line per entry,
+    # [path] for a removed one), so an update only appends what it changed. Once the journal has as many lines as
+    # the snapshot has entries it is compacted into a new snapshot. Both are written outside the cache lock, so
+    # searches never wait for the disk.
+    # don't bother compacting journals shorter than this
+    COMPACT_MINIMUM = 1024
+    def __init__(self, cache_path, parser=None, reader=None, players=None):
+        self.path = cache_path
+        self.version = 0
+        self.__parser = parser if parser else ReplayParser()
+        self.__reader = reader
+        # the PlayerRegistry behind every table, kept across rebuilds so player ids stay the same
+        self.players = players if players is not None else PlayerRegistry()
+        self.__entries = {}
+        self.journal_path = f"{cache_path}.journal"
+        # entries changed since the last write, in order, and the number of lines in the journal file
+        self.__pending = []
+        self.__journal_lines = 0
+        # held while writing, always taken before the cache lock
+        self.__write_lock = Lock()
+        self.__table = None
+        # uuids of the replays in the table, the same game copied into several folders is only counted once
+        self.__table_uuids = set()
+        # replays of new files since the table was built, a changed or removed file forces a rebuild instead
+        self.__appended = []
+        self.__rebuild = False
+        self.__lock = RLock()
+        try:
+            self.__load()
+        except (ValueError, TypeError, KeyError):
+            # unreadable or outdated cache, everything will be re-parsed on the next update
+            self.__entries = {}
+            self.__journal_lines = 0
+
+    @staticmethod
+    def __entry(mtime, size, replay):
+        if replay and "timestamp" not in replay:
+            # written before timestamps were stored, its local-time dates are not trusted
+            raise KeyError("timestamp")
+        return mtime, size, ReplayParser.Replay.from_dictionary(replay) if replay else None
+
+    def __load(self):
+        if path.exists(self.path):
+            with open(self.path, "r") as f:
+                stored = json.load(f)
+            for file_path, (mtime, size, replay) in stored.items():
+                self.__entries[file_path] = self.__entry(mtime, size, replay)
+        if path.exists(self.journal_path):
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        file_path, *entry = json.loads(line)
+                    except ValueError:
+                        # the tail of an append that was cut short
+                        break
+                    if entry:
+                        self.__entries[file_path] = self.__entry(*entry)
+                    else:
+                        self.__entries.pop(file_path, None)
+                    self.__journal_lines += 1
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def directory_files(replays_directory, errors=None):
+        # (path, mtime_ns, size) of every replay file, folders that cannot be read end up in errors
+        for entry in ReplayParser.iter_replay_files(replays_directory, errors):
+            try:
+                file_stat = entry.stat()
+            except OSError:
+                # deleted since the folder was listed
+                continue
+            yield entry.path, file_stat.st_mtime_ns, file_stat.st_size
+
+    @staticmethod
+    def removed_files(known, found, complete=True):
+        # the known paths a walk did not find again. Nothing is removed after a walk that could not read every
+        # folder, or that found no files at all where there used to be some: a dropped network mount or an
+        # unmounted drive looks exactly like that, and would otherwise throw away every parsed replay
+        if not complete or (known and not found):
+            return []
+        return [file_path for file_path in known if file_path not in found]
+
+    def update(self, replays_directory, processes=1, progress=None, cancel=None, progress_every=250, files=None):
+        # progress(done, total, replays) is called with each batch of freshly parsed replays, and setting the
+        # cancel event (anything with is_set) stops the update early while keeping everything parsed so far.
+        # files replaces the directory walk with any iterable of (path, mtime_ns, size)
+        with self.__lock:
+            found = set()
+            stale = {}
+            errors = []
+            if files is None:
+                files = self.directory_files(replays_directory, errors)
+            for file_path, mtime, size in files:
+                if cancel and cancel.is_set():
+                    break
+                found.add(file_path)
+                cached = self.__entries.get(file_path)
+                if cached and cached[0] == mtime and cached[1] == size:
+                    continue
+                stale[file_path] = (mtime, size)
+
+            if stale:
+                stale_paths = list(stale)
+                parsed = self.__parser.parse_replays(stale_paths, processes=processes, ordered=True,
+                                                     reader=self.__reader)
+                batch = []
+                for done, (file_path, replay) in enumerate(zip(stale_paths, parsed), 1):
+                    if file_path in self.__entries:
+                        self.__rebuild = True
+                    elif replay:
+                        self.__appended.append(replay)
+                    self.__entries[file_path] = (*stale[file_path], replay)
+                    self.__pending.append((file_path, self.__entries[file_path]))
+                    if replay:
+                        batch.append(replay)
+                    if progress and (done % progress_every == 0 or done == len(stale_paths)):
+                        progress(done, len(stale_paths), batch)
+                        batch = []
+                    if cancel and cancel.is_set():
+                        break
+                parsed.close()
+
+            if not (cancel and cancel.is_set()):
+                for file_path in self.removed_files(self.__entries, found, complete=not errors):
+                    del self.__entries[file_path]
+                    self.__rebuild = True
+                    self.__pending.append((file_path, None))
+
+            if self.__pending:
+                self.version += 1
+            version = self.version
+        self.__write()
+        return version
+
+    def replays(self):
+        # one replay per uuid, the first path it was found under wins
+        return self.__unique(replay for _, _, replay in self.__entries.values() if replay)
+
+    @staticmethod
+    def __unique(replays, uuids=None):
+        uuids = set() if uuids is None else uuids
+        unique = []
+        for replay in replays:
+            if replay.uuid not in uuids:
+                uuids.add(replay.uuid)
+                unique.append(replay)
+        return unique
+
+    def table(self):
+        with self.__lock:
+            if self.__table is None or self.__rebuild:
+                self.__table_uuids = set()
+                self.__table = ReplayTable(self.__unique(
+                    (replay for _, _, replay in self.__entries.values() if replay), self.__table_uuids
+                ), self.players)
+            else:
+                for replay in self.__unique(self.__appended, self.__table_uuids):
+                    self.__table.append(replay)
+            self.__appended = []
+            self.__rebuild = False
+            return self.__table
+
+    def save(self):
+        # a full snapshot now, instead of waiting for the journal to grow
+        self.__write(compact=True)
+
+    @staticmethod
+    def __record(file_path, entry):
+        if entry is None:
+            return [file_path]
+        mtime, size, replay = entry
+        return [file_path, mtime, size, replay.to_dictionary(timestamp="timestamp") if replay else None]
+
+    def __write(self, compact=False):
+        # the pending entries are taken under the cache lock and written after releasing it; the write lock keeps
+        # writes in the order their entries were changed
+        with self.__write_lock:
+            with self.__lock:
+                pending, self.__pending = self.__pending, []
+                compact = compact or (
+                    self.__journal_lines + len(pending) >= max(self.COMPACT_MINIMUM, len(self.__entries))
+                )
+                entries = dict(self.__entries) if compact else None
+            try:
+                if compact:
+                    # written next to the snapshot and swapped in, so a crash halfway leaves the previous one
+                    temporary_path = f"{self.path}.tmp"
+                    with open(temporary_path, "w") as f:
+                        json.dump({
+                            file_path: self.__record(file_path, entry)[1:] for file_path, entry in entries.items()
+                        }, f)
+                    os.replace(temporary_path, self.path)
+                    # a crash right here replays the old journal over the new snapshot, which only re-parses or
+                    # re-removes those files on the next update
+                    open(self.journal_path, "w").close()
+                    self.__journal_lines = 0
+                elif pending:
+                    with open(self.journal_path, "a") as f:
+                        f.writelines(json.dumps(self.__record(*change)) + "\n" for change in pending)
+                    self.__journal_lines += len(pending)
+            except OSError:
+                print("ERROR WHILE WRITING REPLAY CACHE???")
+                # kept for the next write
+                with self.__lock:
+                    self.__pending[:0] = pending
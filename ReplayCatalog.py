@@ -0,0 +1,191 @@
+import sqlite3
+from PlayerRegistry import PlayerRegistry
+from ReplayCache import ReplayCache
+from ReplayParser import ReplayParser, clean_displayname
+from ReplayTable import ReplayTable
+
+class ReplayCatalog:
+    # An optional SQLite store of parsed replays for archives too large to keep in memory: one row per uuid with
+    # the Replay.to_dictionary keys as columns (missions as their int bitmasks, the date as its ISO text) plus the
+    # exact integer timestamp, indexed on players, venue, setup, result and timestamp. A ReplayQuery is translated
+    # into parameterized SQL, so a search only ever builds the Replay objects that match it.
+    # Player names are matched like ReplayQuery does, by the clean_displayname spellings of display names and
+    # usernames (stored next to the raw names) against PlayerRegistry.spellings of the searched names.
+    # The files table remembers each file's mtime and size like ReplayCache, so update() only parses what changed.
+    COLUMNS = (
+        "uuid", "playid", "date", "spy_displayname", "sniper_displayname", "spy_username", "sniper_username",
+        "result", "venue", "variant", "setup", "guests", "clock", "duration",
+        "selected_missions", "picked_missions", "completed_missions"
+    )
+    __SCHEMA = """
+        CREATE TABLE IF NOT EXISTS replays (
+            uuid TEXT PRIMARY KEY, playid INTEGER, date TEXT, timestamp INTEGER,
+            spy_displayname TEXT, sniper_displayname TEXT, spy_username TEXT, sniper_username TEXT,
+            result TEXT, venue TEXT, variant TEXT, setup TEXT, guests INTEGER, clock INTEGER, duration INTEGER,
+            selected_missions INTEGER, picked_missions INTEGER, completed_missions INTEGER,
+            spy_player TEXT, sniper_player TEXT, spy_account TEXT, sniper_account TEXT
+        );
+        CREATE INDEX IF NOT EXISTS replays_spy_player ON replays (spy_player);
+        CREATE INDEX IF NOT EXISTS replays_sniper_player ON replays (sniper_player);
+        CREATE INDEX IF NOT EXISTS replays_spy_account ON replays (spy_account);
+        CREATE INDEX IF NOT EXISTS replays_sniper_account ON replays (sniper_account);
+        CREATE INDEX IF NOT EXISTS replays_venue ON replays (venue);
+        CREATE INDEX IF NOT EXISTS replays_setup ON replays (setup);
+        CREATE INDEX IF NOT EXISTS replays_result ON replays (result);
+        CREATE INDEX IF NOT EXISTS replays_timestamp ON replays (timestamp);
+        CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, uuid TEXT);
+    """
+    # the columns written by upsert, in the order of __row, and the ones read back in Replay constructor order
+    __INSERT_COLUMNS = (
+        *COLUMNS[:-3], "timestamp", *COLUMNS[-3:], "spy_player", "sniper_player", "spy_account", "sniper_account"
+    )
+    __REPLAY_COLUMNS = ("uuid", "playid", "timestamp", *COLUMNS[3:])
+    # required missions of a setup like "a4/7", and the number of completed missions (SQLite has no popcount)
+    __REQUIRED_SQL = "CAST(substr(setup, 2, instr(setup, '/') - 2) AS INTEGER)"
+    __AVAILABLE_SQL = "CAST(substr(setup, instr(setup, '/') + 1) AS INTEGER)"
+    __COMPLETED_COUNT_SQL = " + ".join(f"((completed_missions >> {bit}) & 1)" for bit in range(8))
+
+    def __init__(self, catalog_path, parser=None, players=None):
+        self.path = catalog_path
+        self.__parser = parser if parser else ReplayParser()
+        self.players = players if players is not None else PlayerRegistry()
+        self.__connection = sqlite3.connect(catalog_path)
+        columns = [column for _, column, *_ in self.__connection.execute("PRAGMA table_info(replays)")]
+        if columns and "timestamp" not in columns:
+            # written before timestamps were stored, everything is parsed again on the next update
+            self.__connection.executescript("DROP TABLE replays; DROP TABLE IF EXISTS files;")
+        self.__connection.executescript(self.__SCHEMA)
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM replays").fetchone()[0]
+
+    def close(self):
+        self.__connection.close()
+
+    def __row(self, replay):
+        dictionary = replay.to_dictionary(
+            selected_missions=None, picked_missions=None, completed_missions=None, timestamp="timestamp"
+        )
+        return (
+            *dictionary.values(), replay.selected_bits, replay.picked_bits, replay.completed_bits,
+            clean_displayname(replay.spy), clean_displayname(replay.sniper),
+            clean_displayname(replay.spy_username), clean_displayname(replay.sniper_username)
+        )
+
+    def upsert(self, replays):
+        # inserts new uuids and overwrites the rows of known ones, in one transaction
+        columns = self.__INSERT_COLUMNS
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        with self.__connection:
+            cursor = self.__connection.executemany(
+                f"INSERT INTO replays ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT (uuid) DO UPDATE SET {updates}",
+                map(self.__row, replays)
+            )
+        return cursor.rowcount
+
+    def update(self, replays_directory, processes=1, batch_size=1000, files=None):
+        # parses new and changed files into the catalog batch by batch, and drops the replays whose files are all
+        # gone; files replaces the directory walk with any iterable of (path, mtime_ns, size) as in ReplayCache
+        known = {
+            file_path: (mtime, size)
+            for file_path, mtime, size in self.__connection.execute("SELECT path, mtime, size FROM files")
+        }
+        found = set()
+        stale = {}
+        errors = []
+        if files is None:
+            files = ReplayCache.directory_files(replays_directory, errors)
+        for file_path, mtime, size in files:
+            found.add(file_path)
+            if known.get(file_path) != (mtime, size):
+                stale[file_path] = (mtime, size)
+
+        stale_paths = list(stale)
+        parsed = self.__parser.parse_replays(stale_paths, processes=processes, ordered=True)
+        for start in range(0, len(stale_paths), batch_size):
+            batch_paths = stale_paths[start:start + batch_size]
+            batch = [replay for _, replay in zip(batch_paths, parsed)]
+            self.upsert(replay for replay in batch if replay)
+            with self.__connection:
+                self.__connection.executemany(
+                    "INSERT OR REPLACE INTO files (path, mtime, size, uuid) VALUES (?, ?, ?, ?)",
+                    ((file_path, *stale[file_path], replay.uuid if replay else None)
+                     for file_path, replay in zip(batch_paths, batch))
+                )
+        parsed.close()
+
+        # the same rule as ReplayCache: nothing is removed after a walk that could not see the whole archive
+        removed = [(file_path,) for file_path in ReplayCache.removed_files(known, found, complete=not errors)]
+        if removed:
+            with self.__connection:
+                self.__connection.executemany("DELETE FROM files WHERE path = ?", removed)
+                self.__connection.execute(
+                    "DELETE FROM replays WHERE uuid NOT IN (SELECT uuid FROM files WHERE uuid IS NOT NULL)"
+                )
+        return len(stale_paths)
+
+    def where(self, query=None, since=None, until=None):
+        # (SQL condition, parameters) of a ReplayQuery, with an optional date range of datetimes [since, until)
+        conditions = []
+        parameters = []
+
+        def any_of(column, values):
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            parameters.extend(values)
+
+        if query is not None:
+            for names, roles in query.players:
+                spellings = sorted(query.registry.spellings(names))
+                placeholders = ", ".join("?" * len(spellings))
+                conditions.append("(" + " OR ".join(
+                    f"{role}_{kind} IN ({placeholders})" for role in roles for kind in ("player", "account")
+                ) + ")")
+                parameters.extend(spellings * (len(roles) * 2))
+            if query.venues is not None:
+                any_of("venue", sorted(query.venues))
+            if query.results is not None:
+                any_of("result", sorted(query.results))
+            if query.mode is not None and query.required is not None and query.available is not None:
+                # a complete setup is one value of the indexed column
+                conditions.append("setup = ?")
+                parameters.append(f"{query.mode}{query.required}/{query.available}")
+            else:
+                for sql, value in (
+                        ("substr(setup, 1, 1)", query.mode), (self.__REQUIRED_SQL, query.required),
+                        (self.__AVAILABLE_SQL, query.available)
+                ):
+                    if value is not None:
+                        conditions.append(f"{sql} = ?")
+                        parameters.append(value)
+            if query.missions:
+                conditions.append("completed_missions & ? = ?")
+                parameters.extend([ReplayParser.missions_to_bits(query.missions)] * 2)
+            if query.countdown:
+                conditions.append(f"{self.__COMPLETED_COUNT_SQL} >= {self.__REQUIRED_SQL}")
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(since.timestamp())
+        if until is not None:
+            conditions.append("timestamp < ?")
+            parameters.append(until.timestamp())
+        return " AND ".join(conditions) if conditions else "1", parameters
+
+    def count(self, query=None, since=None, until=None):
+        condition, parameters = self.where(query, since, until)
+        return self.__connection.execute(f"SELECT COUNT(*) FROM replays WHERE {condition}", parameters).fetchone()[0]
+
+    def search(self, query=None, since=None, until=None, limit=None, descending=False):
+        # yields the matching replays by date, fetched from SQLite as they are consumed
+        condition, parameters = self.where(query, since, until)
+        sql = f"SELECT {', '.join(self.__REPLAY_COLUMNS)} FROM replays WHERE {condition} "
+        sql += f"ORDER BY timestamp {'DESC' if descending else 'ASC'}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        for row in self.__connection.execute(sql, parameters):
+            yield ReplayParser.Replay(*row)
+
+    def table(self, query=None, since=None, until=None):
+        # a ReplayTable of the matches only, for ReplayStats and further in-memory searches
+        return ReplayTable(self.search(query, since, until), self.players)
@@ -0,0 +1,86 @@
+import random
+from base64 import urlsafe_b64encode
+from os import makedirs, path
+from ReplayParser import ReplayParser
+
+class ReplayCorpus:
+    # Writes synthetic .replay files whose headers go through ReplayParser.encode, covering every file version,
+    # every venue the parser knows (with Teien/Aquarium variants and Old Terrace) and variable-length names.
+    # Nothing after the header is real replay data, body_bytes of filler can be added to mimic file sizes.
+    VERSIONS = (2, 3, 4, 5, 6)
+    __RESULTS = ("Missions Win", "Time Out", "Spy Shot", "Civilian Shot")
+    __NAME_CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_- "
+    __UNICODE_CHARACTERS = "éøßñ藤日本語★"
+
+    def __init__(self, seed=0, players=500, parser=None):
+        self.parser = parser if parser else ReplayParser()
+        self.__random = random.Random(seed)
+        self.__venues = self.parser.venue_names() + ["Old Terrace"]
+        self.__players = [self.__player() for _ in range(players)]
+
+    def __name(self, max_bytes):
+        rng = self.__random
+        name = "".join(rng.choice(self.__NAME_CHARACTERS) for _ in range(rng.randint(3, 16)))
+        if rng.random() < 0.1:
+            name += rng.choice(self.__UNICODE_CHARACTERS)
+        while len(name.encode()) > max_bytes:
+            name = name[:-1]
+        return name
+
+    def __player(self):
+        rng = self.__random
+        username = self.__name(26) + ("/steam" if rng.random() < 0.6 else "")
+        display_name = self.__name(135) if rng.random() < 0.7 else username
+        return username, display_name
+
+    def __setup(self):
+        rng = self.__random
+        mode = rng.choice("kpa")
+        required = rng.randint(1, 5)
+        available = required if mode == 'k' else rng.randint(required, 8)
+        return f"{mode}{required}/{available}"
+
+    def replay(self, n):
+        rng = self.__random
+        (spy_username, spy), (sniper_username, sniper) = rng.sample(self.__players, 2)
+        venue = rng.choice(self.__venues)
+        variants = self.parser.variant_names(venue)
+        setup = self.__setup()
+        selected = rng.getrandbits(8)
+        # the first four uuid bytes are the replay number, so uuids never collide within a corpus
+        uuid = urlsafe_b64encode(n.to_bytes(4, 'little') + rng.randbytes(12)).decode()
+        return ReplayParser.Replay(
+            uuid=uuid, playid=rng.randrange(65536),
+            timestamp=rng.randint(1420070400, 1700000000),
+            spy_displayname=spy, sniper_displayname=sniper, spy_username=spy_username, sniper_username=sniper_username,
+            result=rng.choice(self.__RESULTS), venue=venue, variant=rng.choice(variants) if variants else None,
+            setup=setup, guests=rng.randint(3, 21), clock=rng.randrange(60, 400, 15), duration=rng.randint(10, 400),
+            selected_missions=selected, picked_missions=selected & rng.getrandbits(8),
+            completed_missions=selected & rng.getrandbits(8)
+        )
+
+    def headers(self, count, versions=VERSIONS):
+        for n in range(count):
+            file_version = versions[n % len(versions)]
+            replay = self.replay(n)
+            if file_version < 5:
+                # the older formats have no display names, guests or clock
+                replay.spy, replay.sniper = replay.spy_username, replay.sniper_username
+                replay.guests = replay.clock = None
+            if file_version < 6:
+                replay.variant = None
+            yield replay, self.parser.encode(replay, file_version)
+
+    def write(self, directory, count, versions=VERSIONS, files_per_folder=1000, body_bytes=0):
+        file_paths = []
+        filler = bytes(body_bytes)
+        for n, (_, header) in enumerate(self.headers(count, versions)):
+            folder = path.join(directory, f"{n // files_per_folder:05d}")
+            if n % files_per_folder == 0:
+                makedirs(folder, exist_ok=True)
+            file_path = path.join(folder, f"{n:07d}.replay")
+            with open(file_path, "wb") as replay_file:
+                replay_file.write(header)
+                replay_file.write(filler)
+            file_paths.append(file_path)
+        return file_paths
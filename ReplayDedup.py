@@ -0,0 +1,56 @@
+from hashlib import blake2b
+from math import ceil, log
+
+class UuidSet:
+    # Remembers the raw 16 byte uuids of replays already seen, so copies of one game found under several paths are
+    # only decoded and counted once. add() returns whether the uuid is new.
+    def __init__(self):
+        self.__uuids = set()
+
+    def __len__(self):
+        return len(self.__uuids)
+
+    def __contains__(self, raw_uuid):
+        return raw_uuid in self.__uuids
+
+    def add(self, raw_uuid):
+        if raw_uuid in self.__uuids:
+            return False
+        self.__uuids.add(bytes(raw_uuid))
+        return True
+
+class UuidBloomFilter:
+    # The same interface as UuidSet in a fixed amount of memory for archives of many millions of replays: about
+    # 29 bits per uuid at the default error_rate instead of a bytes object and a set slot. A uuid that was never
+    # added is reported as seen with probability error_rate (so that share of unique replays is dropped), a uuid
+    # that was added is never reported as new.
+    def __init__(self, capacity=1_000_000, error_rate=1e-6):
+        self.__size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.__hashes = max(1, round(self.__size / capacity * log(2)))
+        self.__bits = bytearray((self.__size + 7) // 8)
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def __positions(self, raw_uuid):
+        # double hashing, k positions from the two halves of one digest
+        digest = blake2b(raw_uuid, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.__size for i in range(self.__hashes)]
+
+    def __contains__(self, raw_uuid):
+        bits = self.__bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(raw_uuid))
+
+    def add(self, raw_uuid):
+        bits = self.__bits
+        new = False
+        for position in self.__positions(raw_uuid):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+        if new:
+            self.__count += 1
+        return new
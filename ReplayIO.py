@@ -0,0 +1,68 @@
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from os import DirEntry, stat
+
+class ReplayReader:
+    # Reads replay headers for ReplayParser.parse_replays on slow or network storage. Paths are taken in batches,
+    # each batch is sorted by inode (a cheap stand-in for physical order on most filesystems) and read by a bounded
+    # thread pool, optionally through mmap instead of read(). Results keep the input order unless ordered=False.
+    def __init__(self, threads=8, batch_size=256, sort_by_inode=True, use_mmap=False):
+        self.threads = threads
+        self.batch_size = batch_size
+        self.sort_by_inode = sort_by_inode
+        self.use_mmap = use_mmap
+
+    @staticmethod
+    def __read_file(file_path, limit):
+        try:
+            with open(file_path, "rb") as replay_file:
+                return replay_file.read(limit)
+        except OSError:
+            # moved or deleted since it was found, an empty header decodes to None
+            return b""
+
+    @staticmethod
+    def __map_file(file_path, limit):
+        try:
+            with open(file_path, "rb") as replay_file:
+                with mmap.mmap(replay_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return mapped[:limit]
+        except (ValueError, OSError):
+            # empty files cannot be mapped, and unreadable ones read as empty like in __read_file
+            return b""
+
+    @staticmethod
+    def __inode(file_path):
+        # DirEntry objects from os.scandir (ReplayParser.iter_replay_files) already know it on POSIX, a plain path
+        # costs a stat round trip
+        try:
+            return file_path.inode() if isinstance(file_path, DirEntry) else stat(file_path).st_ino
+        except OSError:
+            return 0
+
+    def __read_order(self, batch, pool):
+        # the stats of plain paths run on the pool, so they overlap like the reads do
+        if all(isinstance(file_path, DirEntry) for file_path in batch):
+            inodes = list(map(self.__inode, batch))
+        else:
+            inodes = list(pool.map(self.__inode, batch))
+        return [file_path for _, _, file_path in sorted(zip(inodes, range(len(batch)), batch))]
+
+    def __batches(self, file_paths):
+        batch = []
+        for file_path in file_paths:
+            batch.append(file_path)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def read(self, file_paths, limit, ordered=True):
+        # yields the first limit bytes of every file; file_paths are paths or os.DirEntry objects
+        read_file = self.__map_file if self.use_mmap else self.__read_file
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for batch in self.__batches(file_paths):
+                read_order = self.__read_order(batch, pool) if self.sort_by_inode else batch
+                headers = dict(zip(read_order, pool.map(lambda file_path: read_file(file_path, limit), read_order)))
+                yield from (headers[file_path] for file_path in (batch if ordered else read_order))
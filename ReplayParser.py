@@ -1,26 +1,56 @@
-from struct import unpack, pack
+from struct import Struct, calcsize, unpack, unpack_from, pack, pack_into
+from collections import namedtuple
 from datetime import datetime
-from base64 import urlsafe_b64encode
-from os import walk, path
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from os import scandir
+from functools import partial
+
+def endian_swap(value):
+    return unpack("<I", pack(">I", value))[0]
+
+def clean_displayname(entry: str, lower=True):
+    if entry.endswith("/steam"):
+        entry = entry[:-6]
+    if lower:
+        entry = entry.lower()
+    return entry
+
+def parse_readable(parse, replay_file_path):
+    # parse(replay_file_path), or None for a file that cannot be read any more; a module function so pools can
+    # pickle it
+    try:
+        return parse(replay_file_path)
+    except OSError:
+        return None
 
 class ReplayParser:
     class Replay:
+        # Replays are kept in memory by the thousands, so there is no per-instance __dict__. Missions are kept as
+        # the raw int bitmasks from the header and the date as its timestamp, both are only expanded on access.
+        __slots__ = (
+            "uuid", "playid", "timestamp", "spy", "spy_username", "sniper", "sniper_username",
+            "result", "setup", "venue", "variant", "guests", "clock", "duration",
+            "selected_bits", "picked_bits", "completed_bits", "mission_container"
+        )
+
         def __init__(
-                self, uuid, playid, date,
+                self, uuid, playid, timestamp,
                 spy_displayname, sniper_displayname, spy_username, sniper_username,
                 result, venue, variant, setup, guests, clock, duration,
-                selected_missions, picked_missions, completed_missions
+                selected_missions, picked_missions, completed_missions, mission_container=set
         ):
             x = uuid.find('=')
-            if x:
+            if x != -1:
                 uuid = uuid[:x]
             self.uuid = uuid
             self.playid = playid
-            self.date = date
-            self.spy = spy_displayname
-            self.spy_username = spy_username
-            self.sniper = sniper_displayname
-            self.sniper_username = sniper_username
+            self.timestamp = timestamp
+            if spy_username is not None:
+                # a LazyReplay leaves its names unset until they are read
+                self.spy = spy_displayname
+                self.spy_username = spy_username
+                self.sniper = sniper_displayname
+                self.sniper_username = sniper_username
             self.result = result
             self.setup = setup
             self.venue = venue
@@ -28,9 +58,38 @@ class ReplayParser:
             self.guests = guests
             self.clock = clock
             self.duration = duration
-            self.selected_missions = selected_missions
-            self.completed_missions = completed_missions
-            self.picked_missions = picked_missions if setup[0] == 'p' else None
+            self.selected_bits = selected_missions
+            self.completed_bits = completed_missions
+            self.picked_bits = picked_missions if setup[0] == 'p' else None
+            self.mission_container = mission_container
+
+        def __getstate__(self):
+            return tuple(getattr(self, slot) for slot in ReplayParser.Replay.__slots__)
+
+        def __setstate__(self, state):
+            for slot, value in zip(ReplayParser.Replay.__slots__, state):
+                setattr(self, slot, value)
+
+        @property
+        def date(self):
+            return datetime.fromtimestamp(self.timestamp)
+
+        @property
+        def selected_missions(self):
+            return ReplayParser.bits_to_missions(self.selected_bits, self.mission_container)
+
+        @property
+        def picked_missions(self):
+            if self.picked_bits is None:
+                return None
+            return ReplayParser.bits_to_missions(self.picked_bits, self.mission_container)
+
+        @property
+        def completed_missions(self):
+            return ReplayParser.bits_to_missions(self.completed_bits, self.mission_container)
+
+        def completed_all(self, mission_bits):
+            return self.completed_bits & mission_bits == mission_bits
 
         def spy_win(self):
             return self.result in {"Missions Win", "Civilian Shot"}
@@ -45,8 +104,10 @@ class ReplayParser:
                 result='result', venue='venue', variant='variant', setup='setup',
                 guests='guests', clock='clock', duration='duration',
                 selected_missions='selected_missions', picked_missions='picked_missions',
-                completed_missions='completed_missions'
+                completed_missions='completed_missions', timestamp=None
         ):
+            # keys set to None are left out; the exact integer timestamp is only added on request (ReplayCache
+            # stores it), date is local time and cannot always be turned back into it
             return {
                 key: value for key, value in (
                     (uuid, self.uuid),
@@ -63,13 +124,63 @@ class ReplayParser:
                     (guests, self.guests),
                     (clock, self.clock),
                     (duration, self.duration),
-                    (selected_missions, list(self.selected_missions)),
-                    (picked_missions, list(self.picked_missions) if self.picked_missions else None),
-                    (completed_missions, list(self.completed_missions))
+                    (selected_missions, ReplayParser.bits_to_missions(self.selected_bits, list)),
+                    (picked_missions,
+                     ReplayParser.bits_to_missions(self.picked_bits, list) if self.picked_bits else None),
+                    (completed_missions, ReplayParser.bits_to_missions(self.completed_bits, list)),
+                    (timestamp, self.timestamp)
                 ) if key
             }
 
+        @classmethod
+        def from_dictionary(cls, dictionary):
+            picked_missions = dictionary["picked_missions"]
+            if picked_missions is not None:
+                picked_missions = ReplayParser.missions_to_bits(picked_missions)
+            return cls(
+                uuid=dictionary["uuid"], playid=dictionary["playid"],
+                timestamp=dictionary["timestamp"] if "timestamp" in dictionary else
+                int(datetime.fromisoformat(dictionary["date"]).timestamp()),
+                spy_displayname=dictionary["spy_displayname"], sniper_displayname=dictionary["sniper_displayname"],
+                spy_username=dictionary["spy_username"], sniper_username=dictionary["sniper_username"],
+                result=dictionary["result"], venue=dictionary["venue"], variant=dictionary["variant"],
+                setup=dictionary["setup"], guests=dictionary["guests"], clock=dictionary["clock"],
+                duration=dictionary["duration"],
+                selected_missions=ReplayParser.missions_to_bits(dictionary["selected_missions"]),
+                picked_missions=picked_missions,
+                completed_missions=ReplayParser.missions_to_bits(dictionary["completed_missions"])
+            )
+
+    class LazyReplay(Replay):
+        # A Replay whose four names stay undecoded bytes until one of them is read, for scans whose criteria only
+        # look at fixed fields: a replay rejected on venue or result never pays for its UTF-8 decoding.
+        # The name slots are left unset, so reading one falls through to __getattr__ exactly once.
+        # ReplayParser.decode builds it with None names and then sets name_bytes and name_lengths.
+        __slots__ = ("name_bytes", "name_lengths")
+        __NAMES = ("spy", "sniper", "spy_username", "sniper_username")
+
+        def __getattr__(self, name):
+            if name not in self.__NAMES or self.name_bytes is None:
+                raise AttributeError(name)
+            self.spy, self.sniper, self.spy_username, self.sniper_username = ReplayParser.decode_names(
+                self.name_bytes, self.name_lengths
+            )
+            self.name_bytes = None
+            return getattr(self, name)
+
+        def __setstate__(self, state):
+            # pickled with its names decoded, see Replay.__getstate__
+            self.name_bytes = None
+            super().__setstate__(state)
+
     class __ReplayVersionConstants:
+        __FIELD_FORMATS = (
+            ("spyparty_version", "I"), ("duration", "f"), ("uuid", "16s"), ("timestamp", "I"), ("playid", "H"),
+            ("len_user_spy", "B"), ("len_user_sniper", "B"), ("len_disp_spy", "B"), ("len_disp_sniper", "B"),
+            ("guests", "I"), ("clock", "I"), ("result", "I"), ("setup", "I"), ("venue", "I"), ("variant", "I"),
+            ("missions_s", "I"), ("missions_p", "I"), ("missions_c", "I")
+        )
+
         def __init__(
                 self, magic_number=0x00, file_version=0x04, protocol_version=0x08, spyparty_version=0x0C,
                 duration=0x14, uuid=0x18, timestamp=0x28, playid=0x2C,
@@ -99,36 +210,50 @@ class ReplayParser:
             self.missions_s = missions_s
             self.missions_p = missions_p
             self.missions_c = missions_c
+            self.__compile_header()
+
+        def __compile_header(self):
+            # every fixed-offset field of this version is decoded by one Struct.unpack_from, with pad bytes
+            # skipping the gaps between fields, and comes back as a namedtuple (absent fields are None)
+            present = sorted(
+                (offset, name, code) for name, code in self.__FIELD_FORMATS
+                if (offset := getattr(self, name)) is not None
+            )
+            header_format, position = "<", 0
+            for offset, name, code in present:
+                if offset > position:
+                    header_format += f"{offset - position}x"
+                header_format += code
+                position = offset + calcsize(code)
+            absent = [name for name, _ in self.__FIELD_FORMATS if getattr(self, name) is None]
+            self.header_fields = len(present)
+            self.header = Struct(header_format)
+            self.header_type = namedtuple("Header", [name for _, name, _ in present] + absent,
+                                          defaults=[None] * len(absent))
+
+        def unpack_header(self, sector):
+            return self.header_type(*self.header.unpack_from(sector))
+
+        def pack_header(self, sector, header):
+            # pad bytes are written as zeros, so the magic number and file version have to be written afterwards
+            self.header.pack_into(sector, 0, *header[:self.header_fields])
 
         @staticmethod
         def read_bytes(sector, start, length):
             return sector[start:(start + length)]
 
-        def extract_names(self, sector):
-            total_offset = self.players
-
-            spy_user_len = sector[self.len_user_spy]
-            spy_username = self.read_bytes(sector, total_offset, spy_user_len).decode()
-            total_offset += spy_user_len
+        def name_lengths(self, header):
+            # byte lengths of spy username, sniper username, spy display name and sniper display name, the names
+            # follow each other from the players offset on and versions before 5 have no display names
+            return (
+                header.len_user_spy, header.len_user_sniper, header.len_disp_spy or 0, header.len_disp_sniper or 0
+            )
 
-            sni_user_len = sector[self.len_user_sniper]
-            sniper_username = self.read_bytes(sector, total_offset, sni_user_len).decode()
+        def name_bytes(self, sector, header):
+            return self.read_bytes(sector, self.players, sum(self.name_lengths(header)))
 
-            spy_display_name, sniper_display_name = spy_username, sniper_username
-            if self.len_disp_spy or self.len_disp_sniper:
-                total_offset += sni_user_len
-                spy_disp_len = sector[self.len_disp_spy]
-                spy_display_name = self.read_bytes(sector, total_offset, spy_disp_len).decode()
-
-                total_offset += spy_disp_len
-                sni_disp_len = sector[self.len_disp_sniper]
-                sniper_display_name = self.read_bytes(sector, total_offset, sni_disp_len).decode()
-
-                if not spy_display_name:
-                    spy_display_name = spy_username
-                if not sniper_display_name:
-                    sniper_display_name = sniper_username
-            return spy_display_name, sniper_display_name, spy_username, sniper_username
+        def extract_names(self, sector, header):
+            return ReplayParser.decode_names(self.name_bytes(sector, header), self.name_lengths(header))
 
     __HEADER_DATA_MINIMUM_BYTES = 416
     __HEADER_DATA_USERNAME_LIMIT = 33
@@ -178,7 +303,39 @@ class ReplayParser:
             missions_c=0x50
         )
     }
-    __VENUE_MAP = None
+    # v2 is nearly identical to v3 according to plastikqs!
+    __OFFSETS_DICT[2] = __OFFSETS_DICT[3]
+    # built once when the module is imported, every parser instance shares the venue tables
+    __VENUE_MAP = {
+        0x8802482A: "Old High-rise",
+        endian_swap(0x26C3303A): "High-rise",
+        endian_swap(0xAAFA9659): "Ballroom",
+        endian_swap(0x2519125B): "Ballroom",
+        endian_swap(0xA1C5561A): "High-rise",
+        endian_swap(0x5EAAB328): "Old Gallery",
+        endian_swap(0x750C0A29): "Old Courtyard 2",
+        endian_swap(0x83F59536): "Panopticon",
+        endian_swap(0x91A0BEA8): "Old Veranda",
+        endian_swap(0xBC1F89B8): "Old Balcony",
+        endian_swap(0x4073020D): "Pub",
+        endian_swap(0xF3FF853B): "Pub",
+        endian_swap(0xB0E7C209): "Old Ballroom",
+        endian_swap(0x6B68CFB4): "Old Courtyard",
+        endian_swap(0x8FE37670): "Double Modern",
+        endian_swap(0x206114E6): "Modern",
+        0x6f81a558: "Veranda",
+        0x9dc5bb5e: "Courtyard",
+        0x168f4f62: "Library",
+        0x1dbd8e41: "Balcony",
+        0x7173b8bf: "Gallery",
+        0x9032ce22: "Terrace",
+        0x2e37f15b: "Moderne",
+        0x79dfa0cf: "Teien",
+        0x98e45d99: "Aquarium",
+        0x35ac5135: "Redwoods",
+        0xf3e61461: "Modern"
+    }
+    __VENUE_CODES = {venue: code for code, venue in __VENUE_MAP.items()}
     __VARIANT_MAP = {
         "Teien": [
             "BooksBooksBooks",
@@ -218,56 +375,64 @@ class ReplayParser:
         "Fingerprint": 7,
     }
 
-    def __init__(self):
-        if self.__VENUE_MAP is None:
-            self.__OFFSETS_DICT[2] = self.__OFFSETS_DICT[3]  
-            # v2 is nearly identical to v3 according to plastikqs!
-
-            def endian_swap(value):
-                return unpack("<I", pack(">I", value))[0]
-
-            self.__VENUE_MAP = {
-                0x8802482A: "Old High-rise",
-                endian_swap(0x26C3303A): "High-rise",
-                endian_swap(0xAAFA9659): "Ballroom",
-                endian_swap(0x2519125B): "Ballroom",
-                endian_swap(0xA1C5561A): "High-rise",
-                endian_swap(0x5EAAB328): "Old Gallery",
-                endian_swap(0x750C0A29): "Old Courtyard 2",
-                endian_swap(0x83F59536): "Panopticon",
-                endian_swap(0x91A0BEA8): "Old Veranda",
-                endian_swap(0xBC1F89B8): "Old Balcony",
-                endian_swap(0x4073020D): "Pub",
-                endian_swap(0xF3FF853B): "Pub",
-                endian_swap(0xB0E7C209): "Old Ballroom",
-                endian_swap(0x6B68CFB4): "Old Courtyard",
-                endian_swap(0x8FE37670): "Double Modern",
-                endian_swap(0x206114E6): "Modern",
-                0x6f81a558: "Veranda",
-                0x9dc5bb5e: "Courtyard",
-                0x168f4f62: "Library",
-                0x1dbd8e41: "Balcony",
-                0x7173b8bf: "Gallery",
-                0x9032ce22: "Terrace",
-                0x2e37f15b: "Moderne",
-                0x79dfa0cf: "Teien",
-                0x98e45d99: "Aquarium",
-                0x35ac5135: "Redwoods",
-                0xf3e61461: "Modern"
-            }
+    def venue_names(self):
+        return sorted(set(self.__VENUE_MAP.values()))
+
+    @classmethod
+    def result_names(cls):
+        return list(cls.__RESULT_MAP.values())
+
+    def variant_names(self, venue):
+        return list(self.__VARIANT_MAP.get(venue, ()))
+
+    def venue_codes(self, venues):
+        # the raw header codes of the given venues, Old Terrace is stored with the code of Terrace
+        return {
+            code for code, venue in self.__VENUE_MAP.items()
+            if venue in venues or (venue == "Terrace" and "Old Terrace" in venues)
+        }
 
-    def __unpack_missions(self, sector, offset, container_type):
-        data = self.__unpack_int(sector, offset)
-        missions = container_type()
-        if container_type == set:
-            for mission in self.__MISSION_OFFSETS:
-                if data & (1 << self.__MISSION_OFFSETS[mission]):
-                    missions.add(mission)
-        elif container_type == list:
-            for mission in self.__MISSION_OFFSETS:
-                if data & (1 << self.__MISSION_OFFSETS[mission]):
-                    missions.add(mission)
-        return missions
+    @classmethod
+    def result_codes(cls, results):
+        return {code for code, result in cls.__RESULT_MAP.items() if result in results}
+
+    def setup_name(self, setup_code):
+        # e.g. "a4/7" for a raw header setup word, None for an unknown game mode
+        try:
+            return self.__get_game_type(setup_code)
+        except KeyError:
+            return None
+
+    @staticmethod
+    def decode_names(name_bytes, lengths):
+        # (spy display name, sniper display name, spy username, sniper username), empty display names fall back
+        # to the username
+        names, start = [], 0
+        for length in lengths:
+            names.append(str(name_bytes[start:start + length], "utf-8"))
+            start += length
+        spy_username, sniper_username, spy_display_name, sniper_display_name = names
+        return (
+            spy_display_name or spy_username, sniper_display_name or sniper_username,
+            spy_username, sniper_username
+        )
+
+    @staticmethod
+    def uuid_bytes(uuid):
+        # the 16 raw header bytes behind Replay.uuid, which is stored as unpadded urlsafe base64
+        return urlsafe_b64decode(uuid + "=" * (-len(uuid) % 4))
+
+    @classmethod
+    def missions_to_bits(cls, missions):
+        bits = 0
+        for mission in missions:
+            bits |= 1 << cls.__MISSION_OFFSETS[mission]
+        return bits
+
+    @classmethod
+    def bits_to_missions(cls, bits, container_type=set):
+        missions = [mission for mission, offset in cls.__MISSION_OFFSETS.items() if bits & (1 << offset)]
+        return missions if container_type == list else container_type(missions)
 
     def __get_game_type(self, info):
         mode = info >> 28
@@ -278,96 +443,224 @@ class ReplayParser:
             available = required
         return "%s%d/%d" % (real_mode, required, available)
 
-    @staticmethod
-    def __read_bytes(sector, start, length):
-        return sector[start:(start + length)]
-
-    @staticmethod
-    def __unpack_byte(sector, offset):
-        return unpack('B', sector[offset])[0]
-
-    def __unpack_float(self, sector, offset):
-        return unpack('f', self.__read_bytes(sector, offset, 4))[0]
-
-    def __unpack_int(self, sector, start):
-        return unpack('I', self.__read_bytes(sector, start, 4))[0]
-
-    def __unpack_short(self, sector, start):
-        return unpack('H', self.__read_bytes(sector, start, 2))[0]
-
-    def parse(self, replay_file_path, mission_container=set):
+    def __encode_game_type(self, setup):
+        mode = {real_mode: mode for mode, real_mode in self.__MODE_MAP.items()}[setup[0]]
+        required, available = map(int, setup[1:].split("/"))
+        return (mode << 28) | (available << 14) | required
+
+    def encode(self, replay, file_version=6, spyparty_version=6200):
+        # the inverse of decode, only used to write synthetic replay headers for benchmarks and test data
+        offsets = self.__OFFSETS_DICT[file_version]
+        venue = replay.venue
+        if venue == "Old Terrace":
+            venue, spyparty_version = "Terrace", min(spyparty_version, 6116)
+
+        names = [replay.spy_username, replay.sniper_username]
+        if offsets.len_disp_spy is not None:
+            names.append(replay.spy if replay.spy != replay.spy_username else "")
+            names.append(replay.sniper if replay.sniper != replay.sniper_username else "")
+        names = [name.encode() for name in names]
+        lengths = dict(zip(("len_user_spy", "len_user_sniper", "len_disp_spy", "len_disp_sniper"), map(len, names)))
+
+        header = offsets.header_type(
+            spyparty_version=spyparty_version, duration=float(replay.duration),
+            uuid=self.uuid_bytes(replay.uuid),
+            timestamp=replay.timestamp, playid=replay.playid,
+            guests=replay.guests or 0, clock=replay.clock or 0,
+            result={result: code for code, result in self.__RESULT_MAP.items()}[replay.result],
+            setup=self.__encode_game_type(replay.setup),
+            venue=self.__VENUE_CODES[venue],
+            variant=self.__VARIANT_MAP[venue].index(replay.variant) if replay.variant else 0,
+            missions_s=replay.selected_bits, missions_p=replay.picked_bits or 0, missions_c=replay.completed_bits,
+            **lengths
+        )
+        name_bytes = b"".join(names)
+        sector = bytearray(max(self.__HEADER_DATA_MINIMUM_BYTES, offsets.players + len(name_bytes)))
+        offsets.pack_header(sector, header)
+        sector[0:4] = b"RPLY"
+        pack_into('<I', sector, 0x04, file_version)
+        sector[offsets.players:offsets.players + len(name_bytes)] = name_bytes
+        return bytes(sector)
+
+    @classmethod
+    def header_limit(cls):
+        return cls.__HEADER_DATA_MAXIMUM_BYTES
+
+    def read_header(self, replay_file_path):
         with open(replay_file_path, "rb") as replay_file:
             # Again, thanks to Checker for a fantastic suggestion!
-            bytes_read = bytearray(replay_file.read(self.__HEADER_DATA_MAXIMUM_BYTES))
+            return replay_file.read(self.__HEADER_DATA_MAXIMUM_BYTES)
 
+    def parse(self, replay_file_path, mission_container=set, lazy_names=False, query=None, seen=None):
+        return self.decode(self.read_header(replay_file_path), mission_container, lazy_names, query, seen)
+
+    def decode(self, bytes_read, mission_container=set, lazy_names=False, query=None, seen=None):
+        # lazy_names=True returns a LazyReplay that keeps a copy of the name bytes and decodes them on first access.
+        # With a ReplayQuery only matching replays are returned (None otherwise), its fixed-field criteria are
+        # checked on the raw header before any of the replay is decoded.
+        # seen (a ReplayDedup.UuidSet or UuidBloomFilter) drops replays whose uuid was already decoded, again
+        # straight from the header, so copies of one game under several paths are only built once
         if len(bytes_read) < self.__HEADER_DATA_MINIMUM_BYTES:
-            # raise Exception(f"A minimum of {self.__HEADER_DATA_MINIMUM_BYTES} bytes are required for replay parsing"
-            #                 f" ({replay_file_path})")
+            # raise Exception(f"A minimum of {self.__HEADER_DATA_MINIMUM_BYTES} bytes are required for replay parsing")
             return
 
         if bytes_read[:4] != b"RPLY":
             # raise Exception("Unknown File")
             return
 
-        read_file_version = self.__unpack_int(bytes_read, 0x04)
+        read_file_version = unpack_from('<I', bytes_read, 0x04)[0]
         try:
             offsets = self.__OFFSETS_DICT[read_file_version]
         except KeyError:
             # raise Exception("Unknown file version %d" % read_file_version)
             return
 
-        name_extracts = offsets.extract_names(bytes_read)
-        uuid_offset = offsets.uuid
-
-        date = datetime.fromtimestamp(self.__unpack_int(bytes_read, offsets.timestamp))
-        venue = self.__VENUE_MAP[self.__unpack_int(bytes_read, offsets.venue)]
-        if venue == 'Terrace' and self.__unpack_int(bytes_read, offsets.spyparty_version) < 6117:  # Thanks checker!
+        header = offsets.unpack_header(bytes_read)
+        if query is not None and not query.header_filter(self)(header):
+            return
+        if seen is not None and not seen.add(header.uuid):
+            return
+        try:
+            venue = self.__VENUE_MAP[header.venue]
+            result = self.__RESULT_MAP[header.result]
+            setup = self.__get_game_type(header.setup)
+        except KeyError:
+            # raise Exception("Unknown venue, result or game mode")
+            return
+        if venue == 'Terrace' and header.spyparty_version < 6117:  # Thanks checker!
             venue = "Old Terrace"
 
         variant = None
-        if offsets.variant:
+        if header.variant is not None:
             try:
-                variant = self.__VARIANT_MAP[venue][self.__unpack_int(bytes_read, offsets.variant)]
-            except KeyError:
+                variant = self.__VARIANT_MAP[venue][header.variant]
+            except (KeyError, IndexError):
                 pass
 
-        return ReplayParser.Replay(
-            uuid=urlsafe_b64encode(bytes_read[uuid_offset:uuid_offset + 16]).decode(),
-            playid=self.__unpack_short(bytes_read, offsets.playid), date=date,
+        if lazy_names:
+            replay_type, name_extracts = ReplayParser.LazyReplay, (None, None, None, None)
+        else:
+            replay_type, name_extracts = ReplayParser.Replay, offsets.extract_names(bytes_read, header)
+        replay = replay_type(
+            uuid=urlsafe_b64encode(header.uuid).decode(),
+            playid=header.playid,
+            timestamp=header.timestamp,
             spy_displayname=name_extracts[0], sniper_displayname=name_extracts[1],
             spy_username=name_extracts[2], sniper_username=name_extracts[3],
-            result=self.__RESULT_MAP[self.__unpack_int(bytes_read, offsets.result)],
+            result=result,
             venue=venue, variant=variant,
-            setup=self.__get_game_type(self.__unpack_int(bytes_read, offsets.setup)),
-            guests=self.__unpack_int(bytes_read, offsets.guests) if offsets.guests else None,
-            clock=self.__unpack_int(bytes_read, offsets.clock) if offsets.clock else None,
-            duration=int(self.__unpack_float(bytes_read, offsets.duration)),
-            selected_missions=self.__unpack_missions(bytes_read, offsets.missions_s, mission_container),
-            picked_missions=self.__unpack_missions(bytes_read, offsets.missions_p, mission_container),
-            completed_missions=self.__unpack_missions(bytes_read, offsets.missions_c, mission_container)
+            setup=setup,
+            guests=header.guests,
+            clock=header.clock,
+            duration=int(header.duration),
+            selected_missions=header.missions_s,
+            picked_missions=header.missions_p,
+            completed_missions=header.missions_c,
+            mission_container=mission_container
         )
+        if lazy_names:
+            # copied, the buffer bytes_read comes from is reused for the next file
+            replay.name_bytes = bytes(offsets.name_bytes(bytes_read, header))
+            replay.name_lengths = offsets.name_lengths(header)
+        if query is not None and not query(replay):
+            return
+        return replay
+
+    @staticmethod
+    def iter_replay_files(from_directory, errors=None):
+        # yields os.DirEntry objects as they are found, skipping "__" folders and paths over 255 characters.
+        # Folders that cannot be read (the root included) are skipped too, and their OSErrors appended to errors
+        directories = [from_directory]
+        while directories:
+            directory = directories.pop()
+            if "__" in directory:
+                continue
+            try:
+                with scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        elif entry.name.endswith(".replay"):
+                            if len(entry.path) > 255:
+                                # todo deal with excessively long paths later
+                                continue
+                            yield entry
+            except OSError as error:
+                if errors is not None:
+                    errors.append(error)
 
     @staticmethod
     def find_replays(from_directory):
-        replays = []
-        for root, _, files in walk(from_directory):
-            if "__" in root:
+        return [entry.path for entry in ReplayParser.iter_replay_files(from_directory)]
+
+    def __parse_into_buffer(self, replays, mission_container=set, lazy_names=False, query=None, seen=None):
+        # one preallocated buffer for every file, Replay objects never keep a reference to it
+        buffer = bytearray(self.__HEADER_DATA_MAXIMUM_BYTES)
+        view = memoryview(buffer)
+        for replay_file_path in replays:
+            try:
+                with open(replay_file_path, "rb", buffering=0) as replay_file:
+                    length = replay_file.readinto(buffer)
+            except OSError:
+                # moved or deleted since it was found, like an unparseable file it comes back as None
+                yield None
                 continue
-            for file in files:
-                if file.endswith(".replay"):
-                    file_path = path.join(root, file)
-                    if len(file_path) > 255:
-                        # todo deal with excessively long paths later
-                        continue
-                    replays.append(file_path)
-        return replays
-
-    def parse_replays(self, replays):
-        return map(self.parse, replays)
+            yield self.decode(view[:length], mission_container, lazy_names, query, seen)
+
+    def scan_replays(self, from_directory, mission_container=set, lazy_names=False, query=None, seen=None):
+        replays = self.__parse_into_buffer(
+            (entry.path for entry in self.iter_replay_files(from_directory)), mission_container, lazy_names, query,
+            seen
+        )
+        return (replay for replay in replays if replay)
+
+    def parse_replays(
+            self, replays, processes=1, chunksize=64, ordered=True, reader=None, lazy_names=False, query=None,
+            seen=None
+    ):
+        # processes=None uses every core, results come back in input order unless ordered=False.
+        # A reader (see ReplayIO.ReplayReader) takes over the file reads and decoding stays in this process.
+        # lazy_names only applies in this process, replays from a pool are pickled with their names decoded.
+        # With a query, files that do not match come back as None just like unreadable ones, and so do repeated
+        # uuids with seen
+        if reader is not None:
+            return self.__parse_from_reader(replays, reader, ordered, lazy_names, query, seen)
+        if processes == 1:
+            return self.__parse_into_buffer(replays, lazy_names=lazy_names, query=query, seen=seen)
+        return self.__parse_replays_in_pool(replays, processes, chunksize, ordered, query, seen)
+
+    def __parse_from_reader(self, replays, reader, ordered, lazy_names, query, seen):
+        for bytes_read in reader.read(replays, self.__HEADER_DATA_MAXIMUM_BYTES, ordered):
+            yield self.decode(bytes_read, lazy_names=lazy_names, query=query, seen=seen)
+
+    def __parse_replays_in_pool(self, replays, processes, chunksize, ordered, query, seen):
+        # the query is pickled once per worker task and rejected replays never cross the process boundary,
+        # seen cannot be shared between processes so repeated uuids are only dropped here, after decoding
+        from multiprocessing import Pool  # only scans that ask for processes pay for importing multiprocessing
+        parse = partial(parse_readable, self.parse if query is None else partial(self.parse, query=query))
+        with Pool(processes) as pool:
+            parse_map = pool.imap if ordered else pool.imap_unordered
+            for replay in parse_map(parse, replays, chunksize):
+                if replay and seen is not None and not seen.add(self.uuid_bytes(replay.uuid)):
+                    replay = None
+                yield replay
 
     @staticmethod
     def filter_replays(replays, criteria):
-        return list(filter(lambda replay: not any(not crit(replay) for crit in criteria), replays))
-
-    def find_and_filter_replays(self, replays_directory, criteria):
-        return self.filter_replays(self.parse_replays(self.find_replays(replays_directory)), criteria)
+        # criteria are predicates over Replay objects, a single ReplayQuery already fuses all of its checks
+        if len(criteria) == 1:
+            return list(filter(criteria[0], replays))
+        return list(filter(lambda replay: all(crit(replay) for crit in criteria), replays))
+
+    def find_and_filter_replays(self, replays_directory, criteria, processes=1, lazy_names=False, seen=None):
+        # criteria is either a list of predicates over Replay objects or a ReplayQuery, which is pushed down
+        # into decode so that only matching replays are ever built
+        if callable(criteria):
+            return [replay for replay in self.parse_replays(
+                self.find_replays(replays_directory), processes=processes, ordered=False, lazy_names=lazy_names,
+                query=criteria, seen=seen
+            ) if replay]
+        replays = self.parse_replays(
+            self.find_replays(replays_directory), processes=processes, ordered=False, lazy_names=lazy_names, seen=seen
+        )
+        return self.filter_replays((replay for replay in replays if replay), criteria)
@@ -0,0 +1,107 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Event
+from ReplayParser import ReplayParser
+
+class ReplayPipeline:
+    # Asynchronous ingestion for archives on network mounts, where a synchronous open().read() per file spends
+    # most of its time waiting:
+    #   discovery (scandir in a thread) -> header reads (readers at once) -> decode -> filter -> sink
+    # Every stage hands over through a bounded asyncio.Queue, so a slow stage holds back the ones before it instead
+    # of letting paths or headers pile up in memory.
+    # read_header(path) returns the header bytes and runs in a thread pool, or it can be a coroutine function
+    # (e.g. a shim that adds latency) and is then awaited directly. Results are unordered, like
+    # ReplayParser.find_and_filter_replays with ordered=False.
+    def __init__(self, parser=None, readers=32, queue_size=256, read_header=None):
+        self.parser = parser if parser else ReplayParser()
+        self.readers = readers
+        self.queue_size = queue_size
+        self.read_header = read_header if read_header else self.parser.read_header
+
+    async def __discover(self, replays_directory, paths, stop):
+        loop = asyncio.get_running_loop()
+
+        def walk():
+            for entry in ReplayParser.iter_replay_files(replays_directory):
+                # blocks this thread while the queue is full, until the pipeline stops
+                put = asyncio.run_coroutine_threadsafe(paths.put(entry.path), loop)
+                while True:
+                    try:
+                        put.result(0.1)
+                        break
+                    except TimeoutError:
+                        if stop.is_set():
+                            put.cancel()
+                            return
+
+        await loop.run_in_executor(None, walk)
+        for _ in range(self.readers):
+            await paths.put(None)
+
+    async def __read(self, paths, headers, executor):
+        loop = asyncio.get_running_loop()
+        is_coroutine = asyncio.iscoroutinefunction(self.read_header)
+        while (replay_path := await paths.get()) is not None:
+            try:
+                if is_coroutine:
+                    header = await self.read_header(replay_path)
+                else:
+                    header = await loop.run_in_executor(executor, self.read_header, replay_path)
+            except OSError:
+                continue
+            await headers.put(header)
+        await headers.put(None)
+
+    async def __decode(self, headers, replays, query, seen, lazy_names):
+        finished_readers = 0
+        while finished_readers < self.readers:
+            header = await headers.get()
+            if header is None:
+                finished_readers += 1
+                continue
+            replay = self.parser.decode(header, lazy_names=lazy_names, query=query, seen=seen)
+            if replay:
+                await replays.put(replay)
+        await replays.put(None)
+
+    @staticmethod
+    async def __filter(replays, matches, criteria):
+        while (replay := await replays.get()) is not None:
+            if all(crit(replay) for crit in criteria):
+                await matches.put(replay)
+        await matches.put(None)
+
+    @staticmethod
+    async def __sink(matches, sink):
+        while (replay := await matches.get()) is not None:
+            if asyncio.iscoroutine(result := sink(replay)):
+                await result
+
+    async def run(self, replays_directory, criteria=(), sink=None, seen=None, lazy_names=False):
+        # criteria is a ReplayQuery (checked on the raw headers in the decode stage) or a list of predicates over
+        # Replay objects (the filter stage); sink(replay) may be a coroutine function, without one the matching
+        # replays are returned as a list
+        query = criteria if callable(criteria) else None
+        predicates = () if query is not None else list(criteria)
+        results = []
+        paths, headers, replays, matches = (asyncio.Queue(self.queue_size) for _ in range(4))
+        stop = Event()
+        with ThreadPoolExecutor(max_workers=self.readers) as executor:
+            stages = [asyncio.ensure_future(stage) for stage in (
+                self.__discover(replays_directory, paths, stop),
+                *(self.__read(paths, headers, executor) for _ in range(self.readers)),
+                self.__decode(headers, replays, query, seen, lazy_names),
+                self.__filter(replays, matches, predicates),
+                self.__sink(matches, sink if sink else results.append),
+            )]
+            try:
+                await asyncio.gather(*stages)
+            finally:
+                # a failing stage (e.g. the sink raising) stops all of them, including the discovery thread
+                stop.set()
+                for stage in stages:
+                    stage.cancel()
+        return results
+
+    def find_and_filter_replays(self, replays_directory, criteria=(), seen=None, lazy_names=False):
+        return asyncio.run(self.run(replays_directory, criteria, seen=seen, lazy_names=lazy_names))
@@ -0,0 +1,228 @@
+from PlayerRegistry import PlayerRegistry
+from ReplayParser import ReplayParser, clean_displayname
+
+class ReplayQuery:
+    # A declarative replay search, every criterion left as None (or empty) does not constrain it:
+    #   players     groups of (names, roles), each group has to appear in one of its roles ("spy", "sniper")
+    #   venues, results     any of the given values
+    #   required, available, mode     the setup, e.g. required=4, available=7, mode='a' for a4/7
+    #   missions    all of them completed
+    #   countdown   at least as many missions completed as the setup requires
+    # Player names are expanded into their PlayerRegistry spellings (with its aliases) once, and a replay matches one
+    # when the display name or the username has one of them.
+    # The query compiles into one predicate over Replay objects, into ReplayTable masks and into a filter over raw
+    # header fields that ReplayParser.decode runs before building anything (players are not part of it, their
+    # names are not fixed-offset fields). All of them run their checks
+    # from the most to the least selective (cost over rejection rate), and a check that cannot reject anything, like
+    # every venue being selected, is dropped altogether.
+    ROLES = ("spy", "sniper")
+    # a rough share of replays involving one player, it only has to rank player groups before the other criteria
+    __PLAYER_SELECTIVITY = 0.02
+    # decode also renames Terrace to Old Terrace for replays from before the remodel
+    __VENUES = frozenset(ReplayParser().venue_names() + ["Old Terrace"])
+    __RESULTS = frozenset(ReplayParser.result_names())
+
+    def __init__(self, players=(), venues=None, results=None, missions=None,
+                 required=None, available=None, mode=None, countdown=False, registry=None):
+        self.registry = registry if registry is not None else PlayerRegistry()
+        self.players = [(tuple(names), tuple(roles)) for names, roles in players if names]
+        self.venues = frozenset(venues) if venues else None
+        self.results = frozenset(results) if results else None
+        self.missions = frozenset(missions) if missions else None
+        self.required = required
+        self.available = available
+        self.mode = mode
+        self.countdown = countdown
+        self.__predicate = None
+        self.__header_filter = None
+
+    def __getstate__(self):
+        # compiled checks are closures, a query sent to worker processes recompiles them there
+        state = self.__dict__.copy()
+        state["_ReplayQuery__predicate"] = state["_ReplayQuery__header_filter"] = None
+        return state
+
+    @classmethod
+    def from_search(cls, alias_left=(), alias_right=(), role_match="Either", **criteria):
+        # the player pair of game_search_window: with role_match "Spy" the right-hand player is the spy,
+        # with "Sniper" the right-hand player is the sniper
+        roles = {"Spy": (("sniper",), ("spy",)), "Sniper": (("spy",), ("sniper",))}.get(role_match, (cls.ROLES,) * 2)
+        return cls(players=[(alias_left, roles[0]), (alias_right, roles[1])], **criteria)
+
+    def setup_matches(self, setup):
+        mode = setup[0]
+        required, available = map(int, setup[1:].split("/"))
+        return (
+            (self.mode is None or mode == self.mode) and
+            (self.required is None or required == self.required) and
+            (self.available is None or available == self.available)
+        )
+
+    def __setup_selectivity(self):
+        selectivity = 1.0
+        for value, choices in ((self.mode, 3), (self.required, 5), (self.available, 8)):
+            if value is not None:
+                selectivity /= choices
+        return selectivity
+
+    def __player_check(self, names, roles):
+        # the same rows as ReplayTable.player_rows: a display name or username with a spelling of the names, looked
+        # up once per distinct string; searched names are never registered
+        spellings = self.registry.spellings(names)
+        known = {}
+
+        def spelled(name):
+            matches = known.get(name)
+            if matches is None:
+                matches = known[name] = clean_displayname(name) in spellings
+            return matches
+
+        if roles == ("spy",):
+            return lambda replay: spelled(replay.spy) or spelled(replay.spy_username)
+        if roles == ("sniper",):
+            return lambda replay: spelled(replay.sniper) or spelled(replay.sniper_username)
+        return lambda replay: (spelled(replay.spy) or spelled(replay.spy_username) or
+                               spelled(replay.sniper) or spelled(replay.sniper_username))
+
+    def __plan(self, with_players=True):
+        # (selectivity, cost, replay check, table mask, header check) for every criterion that can reject a replay,
+        # header checks are built from a parser and test the namedtuple of raw header fields
+        plan = []
+        if with_players:
+            for names, roles in self.players:
+                plan.append((
+                    self.__PLAYER_SELECTIVITY * len(names) * len(roles), 3, self.__player_check(names, roles),
+                    lambda table, names=names, roles=roles: table.player_mask(names, roles), None
+                ))
+        if self.venues is not None and not self.__VENUES <= self.venues:
+            venues = self.venues
+            plan.append((
+                len(venues) / len(self.__VENUES), 1, lambda replay: replay.venue in venues,
+                lambda table: table.venue_mask(venues),
+                self.__code_check("venue", lambda parser: parser.venue_codes(venues))
+            ))
+        if self.results is not None and not self.__RESULTS <= self.results:
+            results = self.results
+            plan.append((
+                len(results) / len(self.__RESULTS), 1, lambda replay: replay.result in results,
+                lambda table: table.result_mask(results),
+                self.__code_check("result", lambda parser: parser.result_codes(results))
+            ))
+        if self.mode is not None or self.required is not None or self.available is not None:
+            # a search only ever sees a few dozen distinct setups, each one is checked once
+            setups = {}
+
+            def setup_check(replay):
+                matches = setups.get(replay.setup)
+                if matches is None:
+                    matches = setups[replay.setup] = self.setup_matches(replay.setup)
+                return matches
+
+            plan.append((
+                self.__setup_selectivity(), 2, setup_check,
+                lambda table: table.setup_mask(required=self.required, available=self.available, mode=self.mode),
+                self.__setup_code_check
+            ))
+        if self.missions:
+            bits = ReplayParser.missions_to_bits(self.missions)
+            plan.append((
+                0.5 ** len(self.missions), 1, lambda replay: replay.completed_bits & bits == bits,
+                lambda table: table.mission_mask(self.missions),
+                lambda parser: lambda header: header.missions_c & bits == bits
+            ))
+        if self.countdown:
+            required_missions = {}
+
+            def countdown_check(replay):
+                required = required_missions.get(replay.setup)
+                if required is None:
+                    required = required_missions[replay.setup] = int(replay.setup[1:].split("/")[0])
+                return bin(replay.completed_bits).count("1") >= required
+
+            plan.append((
+                0.5, 2, countdown_check, lambda table: table.countdown_mask(),
+                # the number of required missions is the low 14 bits of the raw setup word
+                lambda parser: lambda header: bin(header.missions_c).count("1") >= header.setup & 0x3FFF
+            ))
+        # the cheapest check per replay it rejects goes first
+        plan.sort(key=lambda step: step[1] / max(1.0 - step[0], 1e-9))
+        return plan
+
+    @staticmethod
+    def __fuse(checks):
+        if not checks:
+            return lambda replay: True
+        if len(checks) == 1:
+            return checks[0]
+
+        def matches(replay):
+            for check in checks:
+                if not check(replay):
+                    return False
+            return True
+        return matches
+
+    @staticmethod
+    def __code_check(field, codes_of):
+        def header_check(parser):
+            codes = frozenset(codes_of(parser))
+            return lambda header: getattr(header, field) in codes
+        return header_check
+
+    def __setup_code_check(self, parser):
+        setups = {}
+
+        def setup_check(header):
+            matches = setups.get(header.setup)
+            if matches is None:
+                setup = parser.setup_name(header.setup)
+                matches = setups[header.setup] = setup is not None and self.setup_matches(setup)
+            return matches
+        return setup_check
+
+    def header_filter(self, parser):
+        # compiled once, a query is only ever used with one set of parser tables
+        if self.__header_filter is None:
+            self.__header_filter = self.__fuse(tuple(
+                header_check(parser) for _, _, _, _, header_check in self.__plan() if header_check is not None
+            ))
+        return self.__header_filter
+
+    def predicate(self):
+        if self.__predicate is None:
+            self.__predicate = self.__fuse(tuple(check for _, _, check, _, _ in self.__plan()))
+        return self.__predicate
+
+    def __call__(self, replay):
+        return self.predicate()(replay)
+
+    def filter(self, replays):
+        return list(filter(self.predicate(), replays))
+
+    def masks(self, table):
+        return [mask(table) for _, _, _, mask, _ in self.__plan()]
+
+    def __posting_values(self, table):
+        # (field, wanted values) of the criteria ReplayTable keeps posting lists for
+        if self.venues is not None and not self.__VENUES <= self.venues:
+            yield "venue", self.venues
+        if self.results is not None and not self.__RESULTS <= self.results:
+            yield "result", self.results
+        if self.mode is not None or self.required is not None or self.available is not None:
+            yield "setup", [setup for setup in table.values("setup") if self.setup_matches(setup)]
+
+    def select(self, table):
+        # posting lists give candidate rows directly: always for players, and for venues, results and setups when
+        # they are rare enough to beat masking whole columns. When the candidates are few the remaining criteria
+        # are checked on them alone
+        candidates = [table.player_rows(names, roles) for names, roles in self.players]
+        for field, values in self.__posting_values(table):
+            if table.value_count(field, values) * 64 < len(table):
+                candidates.append(table.value_rows(field, values))
+        if candidates:
+            candidates.sort(key=len)
+            rows = candidates[0].intersection(*candidates[1:])
+            if len(rows) * 64 < len(table):
+                matches = self.__fuse(tuple(check for _, _, check, _, _ in self.__plan(with_players=False)))
+                return sorted(row for row in rows if matches(table.replays[row]))
+        return table.select(self.masks(table))
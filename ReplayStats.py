@@ -0,0 +1,135 @@
+from datetime import datetime
+
+class ReplayStats:
+    # Per-player win/loss counts by role, computed in one pass over the columns of a ReplayTable. Rows can be
+    # grouped by venue, setup or a date bucket (any strftime format). Every sort order is computed once and then
+    # reused, so re-sorting the same results never touches the replays again.
+    class PlayerResult:
+        __slots__ = (
+            "name", "group",
+            "sn_w", "sn_l", "sn_g", "sn_wr",
+            "sp_w", "sp_l", "sp_g", "sp_wr",
+            "ov_w", "ov_l", "ov_g", "ov_wr"
+        )
+
+        def __init__(self, name, sn_w, sn_l, sp_w, sp_l, group=None):
+            self.name = name
+            self.group = group
+
+            self.sn_w = sn_w
+            self.sn_l = sn_l
+            self.sn_g = sn_w + sn_l
+            self.sn_wr = sn_w / self.sn_g if self.sn_g else None
+
+            self.sp_w = sp_w
+            self.sp_l = sp_l
+            self.sp_g = sp_w + sp_l
+            self.sp_wr = sp_w / self.sp_g if self.sp_g else None
+
+            self.ov_w = sn_w + sp_w
+            self.ov_l = sn_l + sp_l
+            self.ov_g = self.ov_w + self.ov_l
+            self.ov_wr = self.ov_w / self.ov_g
+
+        def overall_wins(self):
+            return f"{self.ov_w}W"
+
+        def overall_losses(self):
+            return f"{self.ov_l}L"
+
+        def overall_winrate(self):
+            return f"{round(100 * self.ov_wr, 1)}%"
+
+        def sniper_wins(self):
+            return f"{self.sn_w}W"
+
+        def sniper_losses(self):
+            return f"{self.sn_l}L"
+
+        def sniper_winrate(self):
+            return f"{round(100 * self.sn_wr, 1)}%" if self.sn_wr is not None else ""
+
+        def spy_wins(self):
+            return f"{self.sp_w}W"
+
+        def spy_losses(self):
+            return f"{self.sp_l}L"
+
+        def spy_winrate(self):
+            return f"{round(100 * self.sp_wr, 1)}%" if self.sp_wr is not None else ""
+
+        def to_dictionary(self):
+            return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    SORT_KEYS = {
+        "alpha": (lambda pr: (pr.group or "", pr.name.lower()), False),
+        "overall": (lambda pr: (pr.ov_w, pr.ov_g), True),
+        "sniper": (lambda pr: (pr.sn_w, pr.sn_g) if pr.sn_g else (0, 0), True),
+        "spy": (lambda pr: (pr.sp_w, pr.sp_g) if pr.sp_g else (0, 0), True),
+    }
+    GROUPS = ("venue", "setup", "date")
+    __SPY_WINS = {"Missions Win", "Civilian Shot"}
+    __UNFINISHED = {"In Progress"}
+
+    def __init__(self, replay_table, rows=None, group_by=None, date_bucket="%Y-%m"):
+        if group_by is not None and group_by not in self.GROUPS:
+            raise ValueError(f"cannot group replays by {group_by!r}, expected one of {self.GROUPS}")
+        self.group_by = group_by
+        self.date_bucket = date_bucket
+        self.__sorted = {}
+
+        results = replay_table.values("result")
+        spy_won = [result in self.__SPY_WINS for result in results]
+        unfinished = [result in self.__UNFINISHED for result in results]
+        group_of = self.__group_function(replay_table)
+
+        # (group, player id) -> [sniper wins, sniper losses, spy wins, spy losses]
+        counts = {}
+        result_column, spy_column, sniper_column = replay_table.result, replay_table.spy, replay_table.sniper
+        for row in range(len(replay_table)) if rows is None else rows:
+            result = result_column[row]
+            if unfinished[result]:
+                continue
+            spy_win = spy_won[result]
+            group = group_of(row) if group_of else None
+            sniper_counts = counts.get((group, sniper_column[row]))
+            if sniper_counts is None:
+                sniper_counts = counts[group, sniper_column[row]] = [0, 0, 0, 0]
+            sniper_counts[1 if spy_win else 0] += 1
+            spy_counts = counts.get((group, spy_column[row]))
+            if spy_counts is None:
+                spy_counts = counts[group, spy_column[row]] = [0, 0, 0, 0]
+            spy_counts[2 if spy_win else 3] += 1
+
+        names = replay_table.player_names
+        self.results = [
+            ReplayStats.PlayerResult(names[player], *player_counts, group=group)
+            for (group, player), player_counts in counts.items()
+        ]
+
+    def __group_function(self, replay_table):
+        if self.group_by is None:
+            return None
+        if self.group_by == "date":
+            timestamps, bucket = replay_table.timestamp, self.date_bucket
+            return lambda row: datetime.fromtimestamp(timestamps[row]).strftime(bucket)
+        column, values = getattr(replay_table, self.group_by), replay_table.values(self.group_by)
+        return lambda row: values[column[row]]
+
+    def __len__(self):
+        return len(self.results)
+
+    def sniper_count(self):
+        return sum(1 for pr in self.results if pr.sn_g)
+
+    def spy_count(self):
+        return sum(1 for pr in self.results if pr.sp_g)
+
+    def groups(self):
+        return sorted({pr.group for pr in self.results if pr.group is not None})
+
+    def sorted(self, key="overall"):
+        if key not in self.__sorted:
+            sort_key, reverse = self.SORT_KEYS[key]
+            self.__sorted[key] = sorted(self.results, key=sort_key, reverse=reverse)
+        return self.__sorted[key]
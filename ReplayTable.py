@@ -0,0 +1,170 @@
+from array import array
+from itertools import compress
+from PlayerRegistry import PlayerRegistry
+from ReplayParser import ReplayParser, clean_displayname
+
+class ReplayTable:
+    # One column per field: venue, result and setup are stored as small-int codes and missions as uint8
+    # bitmasks in bytearrays, so a criterion becomes a single bytes.translate() over the whole column.
+    # Masks hold one 0/1 byte per row and are combined as big integers.
+    def __init__(self, replays=(), players=None):
+        self.replays = []
+        self.venue = bytearray()
+        self.result = bytearray()
+        self.setup = bytearray()
+        self.selected_missions = bytearray()
+        self.picked_missions = bytearray()
+        self.completed_missions = bytearray()
+        self.spy = array('I')
+        self.sniper = array('I')
+        self.timestamp = array('I')
+        self.__venue_codes = {}
+        self.__result_codes = {}
+        self.__setup_codes = {}
+        # spy and sniper hold PlayerRegistry ids, a registry shared between tables keeps the ids stable
+        self.players = players if players is not None else PlayerRegistry()
+        self.player_names = self.players.names
+        # inverted indexes from a code or player id to the rows it appears in, appended to in row order
+        self.__postings = {"spy": {}, "sniper": {}, "venue": {}, "setup": {}, "result": {}}
+        # usernames are posted by their clean_displayname spelling, searches match them as well as display names
+        self.__accounts = {}
+        self.__account_postings = {"spy": {}, "sniper": {}}
+        for replay in replays:
+            self.append(replay)
+
+    def __len__(self):
+        return len(self.replays)
+
+    @staticmethod
+    def __intern(codes, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def __post(self, field, code, row):
+        postings = self.__postings[field].get(code)
+        if postings is None:
+            postings = self.__postings[field][code] = array('I')
+        postings.append(row)
+        return code
+
+    def append(self, replay):
+        row = len(self.replays)
+        self.replays.append(replay)
+        self.venue.append(self.__post("venue", self.__intern(self.__venue_codes, replay.venue), row))
+        self.result.append(self.__post("result", self.__intern(self.__result_codes, replay.result), row))
+        self.setup.append(self.__post("setup", self.__intern(self.__setup_codes, replay.setup), row))
+        self.selected_missions.append(replay.selected_bits & 0xFF)
+        self.picked_missions.append(replay.picked_bits & 0xFF if replay.picked_bits else 0)
+        self.completed_missions.append(replay.completed_bits & 0xFF)
+        self.spy.append(self.__post("spy", self.players.player_id(replay.spy), row))
+        self.sniper.append(self.__post("sniper", self.players.player_id(replay.sniper), row))
+        self.timestamp.append(replay.timestamp)
+        for role, username in (("spy", replay.spy_username), ("sniper", replay.sniper_username)):
+            account = self.__accounts.get(username)
+            if account is None:
+                account = self.__accounts[username] = clean_displayname(username)
+            postings = self.__account_postings[role].get(account)
+            if postings is None:
+                postings = self.__account_postings[role][account] = array('I')
+            postings.append(row)
+
+    def values(self, field):
+        # the value behind every code of a coded column, indexed by code
+        codes = {"venue": self.__venue_codes, "result": self.__result_codes, "setup": self.__setup_codes}[field]
+        return sorted(codes, key=codes.get)
+
+    @staticmethod
+    def __translate(column, wanted_codes):
+        table = bytearray(256)
+        for code in wanted_codes:
+            table[code] = 1
+        return column.translate(table)
+
+    @staticmethod
+    def __split_setup(setup):
+        required, available = setup[1:].split("/")
+        return setup[0], int(required), int(available)
+
+    def venue_mask(self, venues):
+        return self.__translate(self.venue, (self.__venue_codes[v] for v in venues if v in self.__venue_codes))
+
+    def result_mask(self, results):
+        return self.__translate(self.result, (self.__result_codes[r] for r in results if r in self.__result_codes))
+
+    def setup_mask(self, required=None, available=None, mode=None):
+        wanted = []
+        for setup, code in self.__setup_codes.items():
+            setup_mode, setup_required, setup_available = self.__split_setup(setup)
+            if mode is not None and setup_mode != mode:
+                continue
+            if required is not None and setup_required != required:
+                continue
+            if available is not None and setup_available != available:
+                continue
+            wanted.append(code)
+        return self.__translate(self.setup, wanted)
+
+    def mission_mask(self, missions):
+        bits = ReplayParser.missions_to_bits(missions)
+        return self.__translate(self.completed_missions, (m for m in range(256) if m & bits == bits))
+
+    def countdown_mask(self):
+        mask = 0
+        for setup, code in self.__setup_codes.items():
+            required = self.__split_setup(setup)[1]
+            in_setup = self.__translate(self.setup, (code,))
+            enough = self.__translate(
+                self.completed_missions, (m for m in range(256) if bin(m).count("1") >= required)
+            )
+            mask |= int.from_bytes(in_setup, 'little') & int.from_bytes(enough, 'little')
+        return mask.to_bytes(len(self), 'little')
+
+    def player_mask(self, names, roles=("spy", "sniper")):
+        mask = bytearray(len(self))
+        for row in self.player_rows(names, roles):
+            mask[row] = 1
+        return mask
+
+    def __rows(self, field, codes):
+        postings = self.__postings[field]
+        rows = set()
+        for code in codes:
+            rows.update(postings.get(code, ()))
+        return rows
+
+    def __value_codes(self, field, values):
+        codes = {"venue": self.__venue_codes, "setup": self.__setup_codes, "result": self.__result_codes}[field]
+        return [codes[value] for value in values if value in codes]
+
+    def value_count(self, field, values):
+        # how many rows have one of the values in a venue, setup or result column, from the posting list lengths
+        postings = self.__postings[field]
+        return sum(len(postings.get(code, ())) for code in self.__value_codes(field, values))
+
+    def value_rows(self, field, values):
+        return self.__rows(field, self.__value_codes(field, values))
+
+    def player_rows(self, names, roles=("spy", "sniper")):
+        # rows whose display name or username in one of the roles is a spelling of the names (see
+        # PlayerRegistry.spellings)
+        spellings = self.players.spellings(names)
+        ids = {player_id for player_id in map(self.players.display_id, spellings) if player_id is not None}
+        rows = set()
+        for role in roles:
+            rows |= self.__rows(role, ids)
+            account_postings = self.__account_postings[role]
+            for spelling in spellings:
+                rows.update(account_postings.get(spelling, ()))
+        return rows
+
+    def select(self, masks):
+        selected = int.from_bytes(b"\x01" * len(self), 'little')
+        for mask in masks:
+            # every byte is 0 or 1, so the integer AND is a row-wise logical AND
+            selected &= int.from_bytes(mask, 'little')
+        return list(compress(range(len(self)), selected.to_bytes(len(self), 'little')))
+
+    def rows(self, indices):
+        return [self.replays[i] for i in indices]
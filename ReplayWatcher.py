@@ -0,0 +1,51 @@
+from threading import Thread, Event
+
+class ReplayWatcher:
+    # Polls the replays directory and feeds only new or changed files into the ReplayCache, so its in-memory
+    # table stays current while games are being played. snapshot(replays_directory) returns the current files as
+    # (path, mtime_ns, size) and can be swapped for a stand-in that does not touch the disk; without one the cache
+    # walks the directory itself and keeps its entries when a folder cannot be read.
+    def __init__(self, replay_cache, replays_directory, interval=5.0, snapshot=None):
+        self.replay_cache = replay_cache
+        self.replays_directory = replays_directory
+        self.interval = interval
+        self.__snapshot = snapshot
+        self.__stop = Event()
+        self.__thread = None
+        self.last_error = None
+
+    def poll(self):
+        version = self.replay_cache.version
+        files = self.__snapshot(self.replays_directory) if self.__snapshot else None
+        self.replay_cache.update(self.replays_directory, files=files)
+        return self.replay_cache.version != version
+
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self, on_change=None):
+        if self.is_running():
+            return
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__watch, args=(on_change,), daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __watch(self, on_change):
+        while not self.__stop.wait(self.interval):
+            # a failed poll (an unreadable folder, a full disk while saving) is retried on the next one instead of
+            # ending the thread
+            try:
+                changed = self.poll()
+            except Exception as error:
+                self.last_error = error
+                print(f"ERROR WHILE WATCHING REPLAYS: {error!r}")
+                continue
+            self.last_error = None
+            if changed and on_change:
+                on_change()
@@ -0,0 +1,100 @@
+import argparse
+import csv
+import json
+import sys
+from PlayerRegistry import PlayerRegistry
+from ReplayCache import ReplayCache
+from ReplayDedup import UuidSet
+from ReplayParser import ReplayParser
+from ReplayQuery import ReplayQuery
+from ReplayStats import ReplayStats
+from ReplayTable import ReplayTable
+
+# Headless searches for stats servers and scripts: the same criteria as game_search_window, aggregated by ReplayStats
+# and written as JSON or CSV. Nothing here imports client.py, PySimpleGUI or tkinter.
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description="ReParty headless replay search")
+    parser.add_argument("directory", help="the replays directory to scan")
+    parser.add_argument("--players", nargs="+", default=[], help="the left-hand players of a search")
+    parser.add_argument("--versus", nargs="+", default=[], help="the right-hand players of a search")
+    parser.add_argument("--role", choices=["Either", "Sniper", "Spy"], default="Either",
+                        help="the role the --versus players played, as in the search window")
+    parser.add_argument("--mode", choices=["k", "p", "a"], help="known, pick or any setups")
+    parser.add_argument("--required", type=int, help="the number of missions a setup requires")
+    parser.add_argument("--available", type=int, help="the number of missions a setup has available")
+    parser.add_argument("--venues", nargs="+")
+    parser.add_argument("--missions", nargs="+", help="missions that all have to be completed")
+    parser.add_argument("--results", nargs="+")
+    parser.add_argument("--countdown", action="store_true", help="only games where the spy completed enough missions")
+    parser.add_argument("--aliases", help="a JSON file of name groups that belong to one player")
+    parser.add_argument("--processes", type=int, default=1, help="parsing processes, 0 uses every core")
+    parser.add_argument("--cache", help="a ReplayCache file, only new or changed replays are parsed again")
+    parser.add_argument("--group-by", choices=ReplayStats.GROUPS)
+    parser.add_argument("--sort", choices=list(ReplayStats.SORT_KEYS), default="overall")
+    parser.add_argument("--replays", action="store_true", help="write the matching replays instead of player stats")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--output", help="defaults to stdout")
+    return parser
+
+def query_from_arguments(arguments, registry=None):
+    return ReplayQuery.from_search(
+        arguments.players, arguments.versus, arguments.role,
+        venues=arguments.venues, results=arguments.results, missions=arguments.missions,
+        required=arguments.required, available=arguments.available, mode=arguments.mode,
+        countdown=arguments.countdown, registry=registry
+    )
+
+def search(arguments):
+    # returns the ReplayTable to aggregate and the matching rows of it
+    aliases = []
+    if arguments.aliases:
+        with open(arguments.aliases, "r") as f:
+            aliases = json.load(f)
+    registry = PlayerRegistry(aliases)
+    query = query_from_arguments(arguments, registry)
+    processes = arguments.processes or None
+
+    if arguments.cache:
+        replay_cache = ReplayCache(arguments.cache, players=registry)
+        replay_cache.update(arguments.directory, processes=processes)
+        replay_table = replay_cache.table()
+        return replay_table, query.select(replay_table)
+
+    # without a cache the query is pushed down into the parser, only matching replays are ever built
+    replays = ReplayParser().find_and_filter_replays(
+        arguments.directory, query, processes=processes, lazy_names=processes == 1, seen=UuidSet()
+    )
+    replays.sort(key=lambda replay: replay.timestamp)
+    replay_table = ReplayTable(replays, registry)
+    return replay_table, range(len(replay_table))
+
+def write_records(records, fields, output_format, output):
+    if output_format == "csv":
+        writer = csv.DictWriter(output, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        json.dump(records, output, indent=4)
+        output.write("\n")
+
+def main(argv=None):
+    arguments = argument_parser().parse_args(argv)
+    replay_table, rows = search(arguments)
+    if arguments.replays:
+        records = [replay.to_dictionary() for replay in replay_table.rows(rows)]
+        fields = list(records[0]) if records else []
+    else:
+        stats = ReplayStats(replay_table, rows, group_by=arguments.group_by)
+        records = [player_result.to_dictionary() for player_result in stats.sorted(arguments.sort)]
+        fields = list(ReplayStats.PlayerResult.__slots__)
+
+    if arguments.output:
+        with open(arguments.output, "w", newline="") as output:
+            write_records(records, fields, arguments.format, output)
+    else:
+        write_records(records, fields, arguments.format, sys.stdout)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,27 @@
-from os import walk, path
 from Config import Config
-from collections import Counter
-from ReplayParser import ReplayParser
-import PySimpleGUI as sgui
+from PlayerRegistry import PlayerRegistry
+from ReplayCache import ReplayCache
+from ReplayQuery import ReplayQuery
+from ReplayStats import ReplayStats
+from ReplayWatcher import ReplayWatcher
+from threading import Thread, Event
 import datetime
+import importlib
+
+
+class LazyModule:
+    # imports the module on first attribute access, so importing client (or anything it uses) from a script does
+    # not load PySimpleGUI and tkinter, and a GUI launch only pays for them once the first window is built
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attribute)
+
+sgui = LazyModule("PySimpleGUI")
 
 
 start_clock_times = {
@@ -15,7 +33,7 @@ venue_list = [
     "Balcony",
     "Ballroom",
     "Courtyard",
-    "High-Rise",
+    "High-rise",
     "Gallery",
     "Library",
     "Moderne",
@@ -47,6 +65,14 @@ good_styles = [
     'DarkGrey6',
     'DarkTeal11',
 ]
+result_headings = {
+    'name': "Player",
+    'overall_wins': "Ov W", 'overall_losses': "Ov L", 'overall_winrate': "Ov %",
+    'sniper_wins': "Sn W", 'sniper_losses': "Sn L", 'sniper_winrate': "Sn %",
+    'spy_wins': "Sp W", 'spy_losses': "Sp L", 'spy_winrate': "Sp %",
+}
+# rows formatted into the results Table at a time
+results_page_size = 200
 
 def print_most_common_from_counter(ctr, label=None, indent=" ", n=None):
     if label:
@@ -55,13 +81,6 @@ def print_most_common_from_counter(ctr, label=None, indent=" ", n=None):
     for value, count in ctr.most_common(n=n):
         print(f"{indent}{str(count).rjust(largest_count_length)}x {value}")
 
-def clean_displayname(entry: str, lower=True):
-    if entry.endswith("/steam"):
-        entry = entry[:-6]
-    if lower:
-        entry = entry.lower()
-    return entry
-
 def locate_replays_directory(def_dir=""):
     new_replays_directory = sgui.popup_get_folder(
         title='Configure Replays Directory',
@@ -75,22 +94,47 @@ def locate_replays_directory(def_dir=""):
             if sgui.popup_ok_cancel(f'Directory "{new_replays_directory}" was not accepted') == "OK":
                 locate_replays_directory(def_dir)
 
-def scan_and_filter_replays(replays_directory, criteria):
-    replays = []
-    for root, _, files in walk(replays_directory):
-        if "/__" in root:
-            continue
-        for file in files:
-            if file.endswith(".replay"):
-                file_path = path.join(root, file)
-                if len(file_path) > 255:
-                    continue
-                replays.append(file_path)
-    return list(filter(lambda r: all(crit(r) for crit in criteria), map(lambda r: ReplayParser(r).parse(), replays)))
+def scan_and_filter_replays(replay_cache, replays_directory, criteria, progress=None, cancel=None, refresh=True):
+    # criteria is a ReplayQuery,
+    # refresh=False skips the directory scan when a ReplayWatcher is already keeping the cache current
+    if refresh:
+        replay_cache.update(replays_directory, progress=progress, cancel=cancel)
+    if cancel and cancel.is_set():
+        return None
+    replay_table = replay_cache.table()
+    return replay_table, criteria.select(replay_table)
+
+def search_worker(window, replay_cache, replays_directory, criteria, cancel, refresh=True):
+    # runs off the GUI thread, so it only talks to the window through write_event_value
+    matches = 0
+
+    def report_progress(done, total, replays):
+        nonlocal matches
+        matches += len(criteria.filter(replays))
+        window.write_event_value('search_update', (done, total, matches))
+
+    # search_finished is always sent, with the result, None when cancelled or the exception that ended the search,
+    # so the Search button is enabled again whatever happens
+    search_result = None
+    try:
+        search_result = scan_and_filter_replays(replay_cache, replays_directory, criteria,
+                                                progress=report_progress, cancel=cancel, refresh=refresh)
+    except Exception as error:
+        search_result = error
+    finally:
+        window.write_event_value('search_finished', search_result)
 
 def game_search_window(cfg):
     sgui.theme(cfg["theme"])
 
+    # the cache index of a big archive takes a while to read, so it is loaded while Tk builds the window;
+    # groups of names that belong to one player, e.g. [["main account", "smurf/steam"]]
+    loaded = {}
+    cache_loader = Thread(daemon=True, target=lambda: loaded.update(
+        replay_cache=ReplayCache(cfg["replay_cache"], players=PlayerRegistry(cfg["player_aliases"]))
+    ))
+    cache_loader.start()
+
     window = sgui.Window(title='ReParty', layout=[
         [
             sgui.Menu([
@@ -208,15 +252,23 @@ def game_search_window(cfg):
         [sgui.HorizontalSeparator()],
         [
             sgui.Button('Search', key='button_search'),
-            sgui.Text('', key='search_progress', size=(20, 1))
+            sgui.ProgressBar(1000, orientation='h', size=(20, 20), key='search_bar'),
+            sgui.Text('', key='search_progress', size=(40, 1))
         ],
-    ])
+    ], finalize=True)
 
-    replay_batch = []
+    cache_loader.join()
+    replay_cache = loaded["replay_cache"]
+    replay_watcher = ReplayWatcher(replay_cache, cfg["replays_directory"])
+    search_cancel = None
+    search_role = None
 
     while True:
         event, values = window.read()
         if event == sgui.WIN_CLOSED:
+            if search_cancel:
+                search_cancel.set()
+            replay_watcher.stop()
             break
         elif event == 'button_flip':
             left, right = values['alias_left'], values['alias_right']
@@ -287,6 +339,8 @@ def game_search_window(cfg):
             selected = locate_replays_directory(cfg["replays_directory"])
             if selected:
                 cfg["replays_directory"] = selected
+                replay_watcher.stop()
+                replay_watcher = ReplayWatcher(replay_cache, selected)
         elif event in good_styles:
             cfg["theme"] = event
             sgui.theme(event)
@@ -308,29 +362,9 @@ def game_search_window(cfg):
             # window['missions_at_most'](0)
             window['results_wanted'](game_result_list)
         elif event == 'button_search':
-            criteria = []
-            alias_left = [clean_displayname(name.strip()) for name in values['alias_left'].split(",") if name]
-            alias_right = [clean_displayname(name.strip()) for name in values['alias_right'].split(",") if name]
+            alias_left = [name.strip() for name in values['alias_left'].split(",") if name.strip()]
+            alias_right = [name.strip() for name in values['alias_right'].split(",") if name.strip()]
             role_match = values['role_matching']
-            if role_match == 'Spy':
-                if alias_left:
-                    criteria.append(lambda rep: clean_displayname(rep["sniper_displayname"]) in alias_left)
-                if alias_right:
-                    criteria.append(lambda rep: clean_displayname(rep["spy_displayname"]) in alias_right)
-            elif role_match == 'Sniper':
-                if alias_left:
-                    criteria.append(lambda rep: clean_displayname(rep["spy_displayname"]) in alias_left)
-                if alias_right:
-                    criteria.append(lambda rep: clean_displayname(rep["sniper_displayname"]) in alias_right)
-            elif role_match == 'Either':
-                if alias_left:
-                    criteria.append(lambda rep:
-                                    clean_displayname(rep["spy_displayname"]) in alias_left or
-                                    clean_displayname(rep["sniper_displayname"]) in alias_left)
-                if alias_right:
-                    criteria.append(lambda rep:
-                                    clean_displayname(rep["spy_displayname"]) in alias_right or
-                                    clean_displayname(rep["sniper_displayname"]) in alias_right)
             # description = (
             #     f"{alias_left if alias_left else 'Any player'} vs {alias_right if alias_right else 'Any player'}"
             #     f"{f' as {role_match}' if role_match != 'Either' else ''}"
@@ -338,21 +372,19 @@ def game_search_window(cfg):
 
             setup_any = values['venue_setup_any']
             setup_of = values['venue_setup_of']
+            setup = {}
             if setup_any == setup_of != "X":
-                mode = f"k{setup_any}"
-                criteria.append(lambda rep: rep["game_type"] == mode)
-                # description += f" {mode}"
+                setup = {"mode": 'k', "required": int(setup_any)}
+                # description += f" k{setup_any}"
             else:
                 if setup_any != "X":
-                    criteria.append(lambda rep: rep["game_type"][1] == setup_any)
+                    setup["required"] = int(setup_any)
                 if setup_of != "X":
-                    criteria.append(lambda rep: rep["game_type"][3] == setup_of)
+                    setup["available"] = int(setup_of)
                 # if setup_any + setup_of != "XX":
                 #     description += f" a{setup_any}/{setup_of}"
 
             venues_wanted = values['venues_wanted']
-            if venues_wanted:
-                criteria.append(lambda rep: rep["level"] in venues_wanted)
             # num_venues = len(venues_wanted)
             # if num_venues in {0, len(venue_list)}:
             #     description += " on any venue"
@@ -363,19 +395,7 @@ def game_search_window(cfg):
             # else:
             #     description += f" on {', '.join(venues_wanted[:-1])}, or {venues_wanted[-1]}"
 
-            # guests_atl, guests_atm = int(values['guests_at_least']), int(values['guests_at_most'])
-            # criteria.append(lambda rep: guests_atl <= rep["guest_count"] <= guests_atm)
-
-            missions_wanted = set(values['missions_wanted'])
-            if missions_wanted:
-                criteria.append(lambda rep: len(missions_wanted - set(rep["completed_missions"])) == 0)
-            # miss_atl, miss_atm = values['missions_at_least'], values['missions_at_most']
-            # if missions_wanted:
-            #     criteria.append(lambda rep:
-            #                     miss_atl <= len(set(rep["completed_missions"]) & missions_wanted) <= miss_atm)
-            # elif values['missions_at_most']:
-            #     criteria.append(lambda rep: len(rep["completed_missions"]) in
-            #                     range(miss_atl, miss_atm + 1))
+            missions_wanted = values['missions_wanted']
             # if values['missions_at_least']:
             #     description += f" with at least {values['missions_at_least']}"
             #     if values['missions_at_most']:
@@ -383,22 +403,53 @@ def game_search_window(cfg):
             # elif values['missions_at_most']:
             #     description += f" with at most {values['missions_at_most']}"
 
-            results_wanted = values['results_wanted']
-            if results_wanted:
-                criteria.append(lambda rep: rep["result"] in results_wanted)
-            if values["option_countdown"]:
-                criteria.append(lambda rep: len(rep["completed_missions"]) >= int(rep["game_type"][1]))
+            criteria = ReplayQuery.from_search(
+                alias_left, alias_right, role_match,
+                venues=venues_wanted, results=values['results_wanted'], missions=missions_wanted,
+                countdown=values["option_countdown"], registry=replay_cache.players, **setup
+            )
 
             window['search_progress']("Scanning replays...please wait")
-            replay_batch = scan_and_filter_replays(
-                replays_directory=cfg["replays_directory"],
-                criteria=criteria
-            )
-            count = len(replay_batch)
+            window['button_search'].update(disabled=True)
+            search_cancel = Event()
+            search_role = role_match
+            Thread(target=search_worker, daemon=True, kwargs={
+                "window": window,
+                "replay_cache": replay_cache,
+                "replays_directory": cfg["replays_directory"],
+                "criteria": criteria,
+                "cancel": search_cancel,
+                "refresh": not replay_watcher.is_running()
+            }).start()
+        elif event == 'replays_changed':
+            window['search_progress']("New replays found, search again to include them")
+        elif event == 'search_update':
+            done, total, matches = values[event]
+            window['search_bar'].update_bar(done, total)
+            window['search_progress'](f"Parsed {done}/{total} new replays, {matches} matching")
+        elif event == 'Cancel':
+            if search_cancel:
+                search_cancel.set()
+                window['search_progress']("Cancelling...")
+        elif event == 'search_finished':
+            search_cancel = None
+            window['button_search'].update(disabled=False)
+            window['search_bar'].update_bar(0, 1)
+            search_result = values[event]
+            if search_result is None:
+                window['search_progress']("Search cancelled")
+                continue
+            if isinstance(search_result, Exception):
+                window['search_progress'](f"Search failed: {search_result}")
+                continue
+            # the cache is current now, so the watcher only has to pick up files written from here on
+            replay_watcher.start(on_change=lambda: window.write_event_value('replays_changed', None))
+            replay_table, rows = search_result
+            count = len(rows)
             window['search_progress'].update(f"{count} result{'' if count == 1 else 's'} found")
 
             if count:
-                replay_analysis_window(replay_batch, primary_role=role_match)
+                replay_analysis_window(replay_table, rows, primary_role=search_role)
 
     window.close()
 def venue_select_window(cfg):
@@ -471,207 +522,92 @@ def venue_select_window(cfg):
         # return list(filter(None, __venues))
 
     window.close()
-def replay_analysis_window(replays, **params):
-    snipers = {}
-    spies = {}
-    for rep in replays:
-        if rep["result"] == "In Progress":
-            continue
-        spy_win = rep["result"] in {"Missions Win", "Civilian Shot"}
-        snipers.setdefault(clean_displayname(rep["sniper_displayname"], lower=False), Counter())[not spy_win] += 1
-        spies.setdefault(clean_displayname(rep["spy_displayname"], lower=False), Counter())[spy_win] += 1
-
-    class PlayerResult:
-        def __init__(self, name, sn_w, sn_l, sp_w, sp_l):
-            self.name = name
-
-            self.sn_w = sn_w
-            self.sn_l = sn_l
-            self.sn_g = sn_w + sn_l
-            self.sn_wr = sn_w / self.sn_g if self.sn_g else None
-
-            self.sp_w = sp_w
-            self.sp_l = sp_l
-            self.sp_g = sp_w + sp_l
-            self.sp_wr = sp_w / self.sp_g if self.sp_g else None
-
-            self.ov_w = sn_w + sp_w
-            self.ov_l = sn_l + sp_l
-            self.ov_g = self.ov_w + self.ov_l
-            self.ov_wr = self.ov_w / self.ov_g
-
-        def overall_wins(self):
-            return f"{self.ov_w}W"
-
-        def overall_losses(self):
-            return f"{self.ov_l}L"
-
-        def overall_winrate(self):
-            return f"{round(100 * self.ov_wr, 1)}%"
-
-        def sniper_wins(self):
-            return f"{self.sn_w}W"
-
-        def sniper_losses(self):
-            return f"{self.sn_l}L"
-
-        def sniper_winrate(self):
-            return f"{round(100 * self.sn_wr, 1)}%" if self.sn_wr is not None else ""
-
-        def spy_wins(self):
-            return f"{self.sp_w}W"
-
-        def spy_losses(self):
-            return f"{self.sp_l}L"
-
-        def spy_winrate(self):
-            return f"{round(100 * self.sp_wr, 1)}%" if self.sp_wr is not None else ""
-
-    data_list = []
-    for pl in set(snipers) | set(spies):
-        sn_w, sn_l = (snipers[pl][True], snipers[pl][False]) if pl in snipers else (0, 0)
-        sp_w, sp_l = (spies[pl][True], spies[pl][False]) if pl in spies else (0, 0)
-        data_list.append(PlayerResult(pl, sn_w, sn_l, sp_w, sp_l))
-
-    sn_label = "Snipers"
-    sp_label = "Spies"
-    # found = False
-    # for sn in snipers:
-    #     if snipers[sn][True] > 0 or snipers[sn][False] > 0:
-    #         if found:
-    #             break
-    #         found = True
-    # else:
-    #     display_overall = False
-    #     sn_label = "Sniper"
-    #
-    # found = False
-    # for sp in spies:
-    #     if spies[sp][True] > 0 or spies[sp][False] > 0:
-    #         if found:
-    #             break
-    #         found = True
-    # else:
-    #     sp_label = "Spy"
-    #     display_overall = False
+def result_rows(data_list, fields, start=0, stop=None):
+    # only the rows of the current page are ever formatted
+    return [
+        [pr.name] + [getattr(pr, field)() for field in fields]
+        for pr in data_list[start:stop]
+    ]
+def fill_results(window, data_list, fields, page):
+    page_count = max(1, -(-len(data_list) // results_page_size))
+    page = min(max(page, 0), page_count - 1)
+    start = page * results_page_size
+    window['results'].update(values=result_rows(data_list, fields, start, start + results_page_size))
+    window['page'](f"Page {page + 1} of {page_count} ({len(data_list)} players)")
+    return page
+
+def replay_analysis_window(replay_table, rows, **params):
+    stats = ReplayStats(replay_table, rows)
 
     p_role = params["primary_role"]
-    one_snipe, one_spy = len(snipers) == 1, len(spies) == 1
+    one_snipe, one_spy = stats.sniper_count() == 1, stats.spy_count() == 1
+    sort_key = "overall"
     if one_snipe + one_spy == 2:
         if p_role == "Spy":
-            data_list.sort(key=lambda pr: (pr.sp_w, pr.sp_g) if pr.sp_g else (0, 0), reverse=True)
+            sort_key = "spy"
         elif p_role == "Sniper":
-            data_list.sort(key=lambda pr: (pr.sn_w, pr.sn_g) if pr.sn_g else (0, 0), reverse=True)
+            sort_key = "sniper"
         elif p_role == "Either":
             print("HOW DID THIS HAPPEN TO ME?")
-    elif one_snipe + one_spy == 0:
-        data_list.sort(key=lambda pr: (pr.ov_w, pr.ov_g), reverse=True)
     elif one_snipe:
-        data_list.sort(key=lambda pr: (pr.sp_w, pr.sp_g) if pr.sp_g else (0, 0), reverse=True)
+        sort_key = "spy"
     elif one_spy:
-        data_list.sort(key=lambda pr: (pr.sn_w, pr.sn_g) if pr.sn_g else (0, 0), reverse=True)
+        sort_key = "sniper"
 
+    sniper_fields = ['sniper_wins', 'sniper_losses', 'sniper_winrate']
+    spy_fields = ['spy_wins', 'spy_losses', 'spy_winrate']
+    if p_role == 'Either':
+        fields = ['overall_wins', 'overall_losses', 'overall_winrate'] + sniper_fields + spy_fields
+    elif p_role == 'Spy':
+        fields = spy_fields + sniper_fields
+    else:
+        fields = sniper_fields + spy_fields
+    # the sort each column heading switches to
+    heading_sorts = ['alpha'] + [field.split('_')[0] for field in fields]
+
+    # a single Table holds one page of formatted rows, so the window costs the same for 10 players or 10000
     layout = [
-        sgui.Menu([
+        [sgui.Menu([
             ['File', ['Cancel', 'Reset', '---', 'Exit', ]],
             ['Edit', ['Clear Entries', 'Paste', ['Special', 'Normal', ]]],
             ['Configure', ['Replays Directory', 'Choose Style', good_styles]],
             ['Help', 'About...'],
-        ]),
-        sgui.Column([
-            [sgui.Button("Players", size=(20, 1), key='sort_alpha')],
-            [sgui.Column([[sgui.Text(pr.name, size=(19, 1), justification='right')] for pr in data_list])]
-        ])
-    ]
-
-    sniper_segment = [
-        sgui.VerticalSeparator(),
-        sgui.Column([
-            [sgui.Button(sn_label, size=(20, 1), key='sort_sniper')],
-            [
-                sgui.Column([
-                    [sgui.Text(pr.sniper_wins(), justification='right', size=(4, 1), pad=(0, 3))]
-                    for pr in data_list
-                ]),
-                sgui.Column([
-                    [sgui.Text(pr.sniper_losses(), justification='right', size=(4, 1), pad=(0, 3))]
-                    for pr in data_list
-                ]),
-                sgui.Column([
-                    [sgui.Text(pr.sniper_winrate(), justification='right', size=(6, 1), pad=(0, 3))]
-                    for pr in data_list
-                ])
-            ],
-        ])
-    ]
-    spy_segment = [
-        sgui.VerticalSeparator(),
-        sgui.Column([
-            [sgui.Button(sp_label, size=(20, 1), key='sort_spy')],
-            [
-                sgui.Column([
-                    [sgui.Text(pr.spy_wins(), justification='right', size=(4, 1), pad=(0, 3))]
-                    for pr in data_list
-                ]),
-                sgui.Column([
-                    [sgui.Text(pr.spy_losses(), justification='right', size=(4, 1), pad=(0, 3))]
-                    for pr in data_list
-                ]),
-                sgui.Column([
-                    [sgui.Text(pr.spy_winrate(), justification='right', size=(6, 1), pad=(0, 3))]
-                    for pr in data_list
-                ])
-            ]
-        ])
+        ])],
+        [
+            sgui.Button("Players", size=(10, 1), key='sort_alpha'),
+            sgui.Button("Overall", size=(10, 1), key='sort_overall', visible=p_role == 'Either'),
+            sgui.Button("Snipers", size=(10, 1), key='sort_sniper'),
+            sgui.Button("Spies", size=(10, 1), key='sort_spy'),
+        ],
+        [sgui.Table(
+            values=result_rows(stats.sorted(sort_key), fields, 0, results_page_size),
+            headings=[result_headings[field] for field in ['name'] + fields],
+            col_widths=[19] + [6] * len(fields), auto_size_columns=False, justification='right',
+            num_rows=25, enable_click_events=True, key='results'
+        )],
+        [
+            sgui.Button("<", key='page_previous'),
+            sgui.Text("", size=(30, 1), justification='center', key='page'),
+            sgui.Button(">", key='page_next'),
+        ],
     ]
 
-    if p_role == 'Either':
-        layout.extend([
-            sgui.VerticalSeparator(),
-            sgui.Column([
-                [sgui.Button("Overall", size=(20, 1), key='sort_overall')],
-                [
-                    sgui.Column([
-                        [sgui.Text(pr.overall_wins(), justification='right', size=(4, 1), pad=(0, 3))]
-                        for pr in data_list
-                    ]),
-                    sgui.Column([
-                        [sgui.Text(pr.overall_losses(), justification='right', size=(4, 1), pad=(0, 3))]
-                        for pr in data_list
-                    ]),
-                    sgui.Column([
-                        [sgui.Text(pr.overall_winrate(), justification='right', size=(6, 1), pad=(0, 3))]
-                        for pr in data_list
-                    ])
-                ]
-            ])
-        ])
-        layout.extend(sniper_segment)
-        layout.extend(spy_segment)
-    elif p_role == 'Sniper':
-        layout.extend(sniper_segment)
-        layout.extend(spy_segment)
-    elif p_role == 'Spy':
-        layout.extend(spy_segment)
-        layout.extend(sniper_segment)
-
-    window = sgui.Window(title='ReParty: Results', layout=[
-        # [sgui.Button()],
-        [sgui.Column([layout], scrollable=True)]
-    ])
+    window = sgui.Window(title='ReParty: Results', layout=layout, finalize=True)
+    page = fill_results(window, stats.sorted(sort_key), fields, 0)
 
     while True:
         event, values = window.read()
         if event == sgui.WIN_CLOSED:
             break
-        # elif event == 'sort_alpha':
-        #     pass
-        # elif event == 'sort_overall':
-        #     pass
-        # elif event == 'sort_sniper':
-        #     pass
-        # elif event == 'sort_spy':
-        #     pass
+        if isinstance(event, tuple) and event[0] == 'results' and event[2][0] == -1 and event[2][1] is not None:
+            # a click on a column heading sorts by that column's role
+            event = 'sort_' + heading_sorts[event[2][1]]
+        if event in {'sort_alpha', 'sort_overall', 'sort_sniper', 'sort_spy'}:
+            # every order is computed once by ReplayStats, switching back and forth is free
+            sort_key = event[len('sort_'):]
+            page = fill_results(window, stats.sorted(sort_key), fields, 0)
+        elif event in {'page_previous', 'page_next'}:
+            page = fill_results(window, stats.sorted(sort_key), fields, page + (1 if event == 'page_next' else -1))
     window.close()
 def export_replays_to_practice_set(cfg, replays):
     window = sgui.Window(title='ReParty: Replay Export', layout=[
@@ -694,6 +630,8 @@ if __name__ == '__main__':
         "replays_directory": None,
         "theme": 'DarkGrey5',
         "export_directory": None,
+        "replay_cache": "reparty_cache.json",
+        "player_aliases": [],
     }, load_logging=False)
     sgui.theme(config["theme"])
     if not config["replays_directory"]:
@@ -701,10 +639,3 @@ if __name__ == '__main__':
 
     game_search_window(cfg=config)
     config.save()
-
-#
-storage_format = {
-    "uuid": {
-        ""
-    }
-}
@@ -0,0 +1,200 @@
+import argparse
+import json
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import RLock, Thread
+from urllib.parse import urlsplit
+from PlayerRegistry import PlayerRegistry
+from ReplayCache import ReplayCache
+from ReplayQuery import ReplayQuery
+from ReplayStats import ReplayStats
+from ReplayWatcher import ReplayWatcher
+
+# A long-running local service over one warm ReplayCache, so several analysts share a single parsed and indexed
+# archive instead of each scanning it in their own client. Everything is JSON over HTTP:
+#   GET  /status    replay count and cache version
+#   POST /search    criteria -> matching replays (at most "limit", default 1000)
+#   POST /stats     criteria plus optional "group_by" and "sort" -> ReplayStats player results
+# Criteria use the names of the search window: players, versus, role, venues, results, missions, mode, required,
+# available and countdown, all optional.
+
+def checked(criteria, field, valid, expected):
+    # the value of an optional criterion, a ValueError (answered with 400) when it has the wrong type
+    value = criteria.get(field)
+    if value is not None and not valid(value):
+        raise ValueError(f"{field} has to be {expected}")
+    return value
+
+def is_names(value):
+    return isinstance(value, list) and all(isinstance(name, str) for name in value)
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def query_from_json(criteria, registry=None):
+    names_of = {
+        field: checked(criteria, field, is_names, "a list of strings")
+        for field in ("players", "versus", "venues", "results", "missions")
+    }
+    return ReplayQuery.from_search(
+        names_of["players"] or (), names_of["versus"] or (),
+        checked(criteria, "role", lambda value: value in ("Either", "Spy", "Sniper"), '"Either", "Spy" or "Sniper"')
+        or "Either",
+        venues=names_of["venues"], results=names_of["results"], missions=names_of["missions"],
+        required=checked(criteria, "required", is_count, "a count"),
+        available=checked(criteria, "available", is_count, "a count"),
+        mode=checked(criteria, "mode", lambda value: value in ("k", "p", "a"), '"k", "p" or "a"'),
+        countdown=bool(checked(criteria, "countdown", lambda value: isinstance(value, bool), "true or false")),
+        registry=registry
+    )
+
+class ReplayServer:
+    def __init__(self, replay_cache, replays_directory, host="127.0.0.1", port=8787, interval=5.0):
+        self.replay_cache = replay_cache
+        self.replays_directory = replays_directory
+        self.replay_watcher = ReplayWatcher(replay_cache, replays_directory, interval=interval)
+        # the table grows in place when the watcher appends to it, so reads of it are serialized
+        self.__lock = RLock()
+        # dashboards repeat the same queries, answers are reused until the cache version changes
+        self.__answers = OrderedDict()
+        self.__answers_limit = 256
+        self.__http = ThreadingHTTPServer((host, port), self.__handler())
+        self.__http.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def address(self):
+        # (host, port), port=0 in the constructor picks a free one
+        return self.__http.server_address
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if urlsplit(self.path).path == "/status":
+                    self.__respond(200, server.status())
+                else:
+                    self.__respond(404, {"error": f"unknown path {self.path}"})
+
+            def do_POST(self):
+                routes = {"/search": server.search, "/stats": server.stats}
+                route = routes.get(urlsplit(self.path).path)
+                if route is None:
+                    self.__respond(404, {"error": f"unknown path {self.path}"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    criteria = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(criteria, dict):
+                        raise ValueError("criteria have to be a JSON object")
+                    self.__respond(200, route(criteria))
+                except (ValueError, TypeError, KeyError) as error:
+                    self.__respond(400, {"error": str(error)})
+
+            def __respond(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, message_format, *args):
+                pass
+
+        return Handler
+
+    def status(self):
+        with self.__lock:
+            return {"replays": len(self.replay_cache.table()), "version": self.replay_cache.version}
+
+    def __select(self, criteria):
+        query = query_from_json(criteria, self.replay_cache.players)
+        replay_table = self.replay_cache.table()
+        return replay_table, query.select(replay_table)
+
+    def __answer(self, route, criteria, compute):
+        with self.__lock:
+            key = (route, self.replay_cache.version, json.dumps(criteria, sort_keys=True))
+            answer = self.__answers.get(key)
+            if answer is None:
+                answer = self.__answers[key] = compute(*self.__select(criteria))
+                if len(self.__answers) > self.__answers_limit:
+                    self.__answers.popitem(last=False)
+            else:
+                self.__answers.move_to_end(key)
+            return answer
+
+    def search(self, criteria):
+        limit = checked(criteria, "limit", is_count, "a count")
+        limit = 1000 if limit is None else limit
+
+        def compute(replay_table, rows):
+            replays = [replay.to_dictionary() for replay in replay_table.rows(rows[:limit])]
+            return {"matches": len(rows), "replays": replays}
+        return self.__answer("search", criteria, compute)
+
+    def stats(self, criteria):
+        group_by = checked(criteria, "group_by", lambda value: value in ReplayStats.GROUPS, "venue, setup or date")
+        sort = checked(
+            criteria, "sort", lambda value: isinstance(value, str) and value in ReplayStats.SORT_KEYS,
+            "a ReplayStats sort key"
+        )
+
+        def compute(replay_table, rows):
+            stats = ReplayStats(replay_table, rows, group_by=group_by)
+            players = [player_result.to_dictionary() for player_result in stats.sorted(sort or "overall")]
+            return {"matches": len(rows), "players": players}
+        return self.__answer("stats", criteria, compute)
+
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self, processes=1):
+        # one full update before answering anything, the watcher keeps the cache current from then on
+        self.replay_cache.update(self.replays_directory, processes=processes)
+        self.replay_watcher.start()
+        self.__thread = Thread(target=self.__http.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def wait(self, timeout=None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def stop(self):
+        self.replay_watcher.stop()
+        self.__http.shutdown()
+        self.__http.server_close()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description="ReParty replay query service")
+    argument_parser.add_argument("directory", help="the replays directory to serve")
+    argument_parser.add_argument("--cache", default="reparty_cache.json")
+    argument_parser.add_argument("--aliases", help="a JSON file of name groups that belong to one player")
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=8787)
+    argument_parser.add_argument("--processes", type=int, default=1, help="parsing processes, 0 uses every core")
+    argument_parser.add_argument("--interval", type=float, default=5.0, help="seconds between checks for new replays")
+    arguments = argument_parser.parse_args()
+
+    aliases = []
+    if arguments.aliases:
+        with open(arguments.aliases, "r") as f:
+            aliases = json.load(f)
+    replay_server = ReplayServer(
+        ReplayCache(arguments.cache, players=PlayerRegistry(aliases)), arguments.directory,
+        host=arguments.host, port=arguments.port, interval=arguments.interval
+    )
+    replay_server.start(processes=arguments.processes or None)
+    print(f"serving {arguments.directory} on http://{arguments.host}:{replay_server.address[1]}")
+    try:
+        while replay_server.is_running():
+            replay_server.wait(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replay_server.stop()
@@ -0,0 +1,37 @@
+import os
+import pytest
+from ReplayCatalog import ReplayCatalog
+from ReplayCache import ReplayCache
+from ReplayCorpus import ReplayCorpus
+
+# ReplayCatalog.update() shares ReplayCache's walk, so a root it cannot see never deletes the catalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    replays_directory = tmp_path / "replays"
+    ReplayCorpus(seed=5).write(str(replays_directory), 60, files_per_folder=20)
+    replay_catalog = ReplayCatalog(str(tmp_path / "catalog.db"))
+    replay_catalog.update(str(replays_directory))
+    yield replays_directory, replay_catalog
+    replay_catalog.close()
+
+
+def test_unreadable_root_keeps_the_catalog(catalog, tmp_path):
+    replays_directory, replay_catalog = catalog
+    os.rename(replays_directory, tmp_path / "renamed")
+    assert replay_catalog.update(str(replays_directory)) == 0
+    assert len(replay_catalog) == 60
+
+
+def test_empty_walk_keeps_the_catalog(catalog):
+    replays_directory, replay_catalog = catalog
+    replay_catalog.update(str(replays_directory), files=[])
+    assert len(replay_catalog) == 60
+
+
+def test_removed_files_are_still_dropped(catalog):
+    replays_directory, replay_catalog = catalog
+    files = list(ReplayCache.directory_files(str(replays_directory)))
+    replay_catalog.update(str(replays_directory), files=files[:45])
+    assert len(replay_catalog) == 45
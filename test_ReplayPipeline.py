@@ -0,0 +1,108 @@
+import asyncio
+import shutil
+import threading
+import pytest
+from ReplayBenchmark import with_latency
+from ReplayCorpus import ReplayCorpus
+from ReplayDedup import UuidSet
+from ReplayParser import ReplayParser
+from ReplayPipeline import ReplayPipeline
+from ReplayQuery import ReplayQuery
+
+# ReplayPipeline against ReplayParser.find_and_filter_replays on a small synthetic corpus, with every header read
+# going through the latency shim of ReplayBenchmark so the stages really overlap and the queues fill up
+
+LATENCY = 0.0005
+QUERY = ReplayQuery(venues=["Teien", "Balcony", "Aquarium"])
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("replays")
+    ReplayCorpus(seed=7).write(str(directory / "a"), 400, files_per_folder=100)
+    # a second copy of some folders, so seen has repeated uuids to drop
+    shutil.copytree(directory / "a" / "00000", directory / "b")
+    return str(directory)
+
+
+@pytest.fixture(scope="module")
+def parser():
+    return ReplayParser()
+
+
+def uuids(replays):
+    return sorted(replay.uuid for replay in replays)
+
+
+@pytest.mark.parametrize("is_async", [False, True])
+@pytest.mark.parametrize("readers, queue_size", [(32, 256), (4, 1)])
+def test_same_results_as_find_and_filter_replays(corpus, parser, is_async, readers, queue_size):
+    read_header = with_latency(parser.read_header, LATENCY)[is_async]
+    pipeline = ReplayPipeline(parser, readers=readers, queue_size=queue_size, read_header=read_header)
+
+    assert uuids(pipeline.find_and_filter_replays(corpus, QUERY)) == uuids(
+        parser.find_and_filter_replays(corpus, QUERY)
+    )
+    criteria = [lambda replay: replay.result == "Spy Shot"]
+    assert uuids(pipeline.find_and_filter_replays(corpus, criteria)) == uuids(
+        parser.find_and_filter_replays(corpus, criteria)
+    )
+    deduplicated = pipeline.find_and_filter_replays(corpus, QUERY, seen=UuidSet())
+    assert len(deduplicated) < len(pipeline.find_and_filter_replays(corpus, QUERY))
+    assert uuids(deduplicated) == uuids(parser.find_and_filter_replays(corpus, QUERY, seen=UuidSet()))
+    assert len(set(uuids(deduplicated))) == len(deduplicated)
+
+
+def test_unreadable_files_are_skipped(corpus, parser):
+    slow_read_header = with_latency(parser.read_header, LATENCY)[0]
+    paths = parser.find_replays(corpus)
+    vanished = set(paths[::7])
+
+    def read_header(replay_path):
+        if replay_path in vanished:
+            raise FileNotFoundError(replay_path)
+        return slow_read_header(replay_path)
+
+    expected = [replay for replay in parser.parse_replays(set(paths) - vanished) if replay]
+    pipeline = ReplayPipeline(parser, readers=8, queue_size=4, read_header=read_header)
+    assert uuids(pipeline.find_and_filter_replays(corpus)) == uuids(expected)
+
+
+@pytest.mark.parametrize("is_async", [False, True])
+def test_failing_sink_stops_every_stage(corpus, parser, is_async):
+    read_header = with_latency(parser.read_header, LATENCY)[is_async]
+    reads = []
+
+    def counting_read_header(replay_path):
+        reads.append(replay_path)
+        return read_header(replay_path)
+
+    async def async_counting_read_header(replay_path):
+        reads.append(replay_path)
+        return await read_header(replay_path)
+
+    def sink(replay):
+        raise RuntimeError("sink failed")
+
+    threads = threading.active_count()
+    pipeline = ReplayPipeline(
+        parser, readers=4, queue_size=2,
+        read_header=async_counting_read_header if is_async else counting_read_header
+    )
+    with pytest.raises(RuntimeError, match="sink failed"):
+        asyncio.run(pipeline.run(corpus, sink=sink))
+    # the bounded queues held discovery and the readers back, and nothing is left running afterwards
+    assert len(reads) < len(parser.find_replays(corpus))
+    assert threading.active_count() == threads
+
+
+def test_coroutine_sink(corpus, parser):
+    received = []
+
+    async def sink(replay):
+        await asyncio.sleep(0)
+        received.append(replay)
+
+    pipeline = ReplayPipeline(parser, read_header=with_latency(parser.read_header, LATENCY)[1])
+    assert asyncio.run(pipeline.run(corpus, QUERY, sink=sink)) == []
+    assert uuids(received) == uuids(parser.find_and_filter_replays(corpus, QUERY))
@@ -0,0 +1,66 @@
+import os
+import time
+import pytest
+from ReplayCache import ReplayCache
+from ReplayCorpus import ReplayCorpus
+from ReplayWatcher import ReplayWatcher
+
+# A poll that cannot see the archive (an unreadable or renamed root, a snapshot stand-in that fails or comes back
+# empty like an unmounted drive) must leave the cache and its file alone
+
+
+@pytest.fixture
+def archive(tmp_path):
+    replays_directory = tmp_path / "replays"
+    ReplayCorpus(seed=3).write(str(replays_directory), 60, files_per_folder=20)
+    replay_cache = ReplayCache(str(tmp_path / "cache.json"))
+    replay_cache.update(str(replays_directory))
+    return replays_directory, replay_cache
+
+
+def cached_on_disk(replay_cache):
+    return len(ReplayCache(replay_cache.path))
+
+
+def test_unreadable_root_keeps_the_cache(archive, tmp_path):
+    replays_directory, replay_cache = archive
+    os.rename(replays_directory, tmp_path / "renamed")
+    replay_watcher = ReplayWatcher(replay_cache, str(replays_directory))
+    assert not replay_watcher.poll()
+    assert len(replay_cache) == cached_on_disk(replay_cache) == 60
+
+
+@pytest.mark.parametrize("snapshot", [lambda replays_directory: [], lambda replays_directory: iter(())])
+def test_empty_snapshot_keeps_the_cache(archive, snapshot):
+    replays_directory, replay_cache = archive
+    replay_watcher = ReplayWatcher(replay_cache, str(replays_directory), snapshot=snapshot)
+    assert not replay_watcher.poll()
+    assert len(replay_cache) == cached_on_disk(replay_cache) == 60
+
+
+def test_failing_snapshot_keeps_the_watcher_and_the_cache(archive):
+    replays_directory, replay_cache = archive
+    polls = []
+
+    def snapshot(replays_directory):
+        polls.append(replays_directory)
+        raise OSError("mount dropped")
+
+    replay_watcher = ReplayWatcher(replay_cache, str(replays_directory), interval=0.01, snapshot=snapshot)
+    replay_watcher.start()
+    try:
+        while len(polls) < 3:
+            time.sleep(0.01)
+        assert replay_watcher.is_running()
+        assert isinstance(replay_watcher.last_error, OSError)
+    finally:
+        replay_watcher.stop()
+    assert len(replay_cache) == cached_on_disk(replay_cache) == 60
+
+
+def test_removed_files_are_still_dropped(archive):
+    replays_directory, replay_cache = archive
+    files = list(ReplayCache.directory_files(str(replays_directory)))
+    replay_watcher = ReplayWatcher(replay_cache, str(replays_directory), snapshot=lambda replays_directory: files[:45])
+    assert replay_watcher.poll()
+    assert len(replay_cache) == cached_on_disk(replay_cache) == 45